@@ -0,0 +1,137 @@
+import time
+import sqlite3
+import hashlib
+
+
+class CrawlState:
+    """
+    A durable record of the crawling, stored in a SQLite database.
+
+    Each crawling of a keyword is a run. The search pages finished by a run
+    and the articles' links they contain are recorded, so an interrupted run
+    can be resumed without crawling those pages again. Each article keeps
+    its fetching status and the hash of its extracted text for each run, so
+    the articles finished by the interrupted run, or by any earlier run in
+    incremental mode, won't be fetched again.
+
+    The changes are only committed by 'commit', which the crawler calls
+    once the articles have reached the output file.
+
+    Several keywords can be crawled at the same time with the states made by
+    'fork', which share the database connection but each has its own run.
+    """
+
+    def __init__(self, filename, db=None):
+        self._filename = filename
+        self._run = None
+        self._resumed = False
+        self._db = db if db is not None else sqlite3.connect(filename)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, keyword TEXT, started_at REAL, finished INTEGER);
+            CREATE TABLE IF NOT EXISTS pages (
+                run INTEGER, page INTEGER, PRIMARY KEY (run, page));
+            CREATE TABLE IF NOT EXISTS links (
+                run INTEGER, url TEXT, PRIMARY KEY (run, url));
+            CREATE TABLE IF NOT EXISTS articles (
+                url TEXT, status TEXT, http_status INTEGER, text_hash TEXT, run INTEGER, updated_at REAL,
+                PRIMARY KEY (run, url));
+            CREATE INDEX IF NOT EXISTS article_urls ON articles (url);
+        ''')
+
+
+    @property
+    def filename(self):
+        return self._filename
+
+
+    @property
+    def resumed(self):
+        return self._resumed
+
+
+    def fork(self):
+        """
+        :returns: a new state sharing the database with this one
+        """
+        return CrawlState(self._filename, self._db)
+
+
+    def start_run(self, keyword):
+        """
+        Resume the last unfinished run of the keyword, or start a new one.
+
+        :returns: True if a run is resumed
+        """
+        row = self._db.execute('SELECT id FROM runs WHERE keyword = ? AND finished = 0 ORDER BY id DESC LIMIT 1',
+                               (keyword,)).fetchone()
+        if row is not None:
+            self._run = row[0]
+            self._resumed = True
+        else:
+            self._run = self._db.execute('INSERT INTO runs (keyword, started_at, finished) VALUES (?, ?, 0)',
+                                         (keyword, time.time())).lastrowid
+            self._resumed = False
+            self._db.commit()
+        return self._resumed
+
+
+    def finish_run(self):
+        self._db.execute('UPDATE runs SET finished = 1 WHERE id = ?', (self._run,))
+        self._db.commit()
+
+
+    def page_done(self, page):
+        """
+        :returns: True if the search page is finished by the current run
+        """
+        return self._db.execute('SELECT 1 FROM pages WHERE run = ? AND page = ?', (self._run, page)).fetchone() is not None
+
+
+    def add_page(self, page, links):
+        """
+        Record a finished search page and the articles' links on it.
+        """
+        self._db.executemany('INSERT OR IGNORE INTO links VALUES (?, ?)', ((self._run, l) for l in links))
+        self._db.execute('INSERT OR IGNORE INTO pages VALUES (?, ?)', (self._run, page))
+
+
+    def links(self):
+        """
+        :returns: a list of the articles' links found by the current run
+        """
+        return [row[0] for row in self._db.execute('SELECT url FROM links WHERE run = ?', (self._run,))]
+
+
+    def seen(self, url, incremental=False):
+        """
+        Check if an article needs to be fetched.
+
+        :param incremental: True to accept the articles finished by any run
+        :returns: True if the article is finished by the current run, or by
+                  any run in incremental mode
+        """
+        if incremental:
+            row = self._db.execute('SELECT 1 FROM articles WHERE url = ? AND status = ? LIMIT 1', (url, 'done')).fetchone()
+        else:
+            row = self._db.execute('SELECT 1 FROM articles WHERE run = ? AND url = ? AND status = ?',
+                                   (self._run, url, 'done')).fetchone()
+        return row is not None
+
+
+    def done(self, url, http_status, text):
+        self._db.execute('INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?)',
+                         (url, 'done', http_status, hashlib.sha1(text.encode('UTF-8')).hexdigest(), self._run, time.time()))
+
+
+    def failed(self, urls):
+        self._db.executemany('INSERT OR IGNORE INTO articles VALUES (?, ?, NULL, NULL, ?, ?)',
+                             ((url, 'failed', self._run, time.time()) for url in urls))
+
+
+    def commit(self):
+        self._db.commit()
+
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,82 @@
+import re
+from lxml import etree
+from urllib.parse import unquote
+
+
+def _has_class(name):
+    """
+    The XPath predicate that works like 'class_=name' of Beautifulsoup.
+    """
+    return 'contains(concat(" ", normalize-space(@class), " "), " {} ")'.format(name)
+
+
+def _parse(source):
+    """
+    Build the lxml tree of a page.
+
+    :param source: the source code, or the undecoded response body
+    :returns: the root element, None if the page is empty or broken
+    """
+    if not source:
+        return None
+    parser = etree.HTMLParser(encoding='utf-8') if isinstance(source, bytes) else etree.HTMLParser()
+    try:
+        return etree.fromstring(source, parser)
+    except (etree.ParserError, etree.XMLSyntaxError, ValueError):
+        return None
+
+
+class XPathExtractor:
+    """
+    Get the title and the content of an article from its source code
+    without building the soup object of the whole page.
+    Each type of websites has its own extractor, keyed by the integers in
+    '_websites' of the crawler.
+    The elements are found with lxml's XPath. The tree is built in C and
+    only the two elements are serialized.
+    """
+
+    def __init__(self, title_tag, content_tag):
+        self._title_tag = title_tag
+        self._content_tag = content_tag
+        self._title_xpath = etree.XPath('(//*[{}])[1]'.format(_has_class(title_tag)))
+        self._content_xpath = etree.XPath('(//*[{}])[1]'.format(_has_class(content_tag)))
+
+
+    def _find(self, root, xpath):
+        found = xpath(root)
+        if not found:
+            return None
+        return etree.tostring(found[0], encoding='unicode', method='html', with_tail=False)
+
+
+    def extract(self, source):
+        """
+        :param source: the source code, or the undecoded response body
+        :returns: a tuple of the HTML of (title, content), None if not found
+        """
+        root = _parse(source)
+        if root is None:
+            return None, None
+        return self._find(root, self._title_xpath), self._find(root, self._content_xpath)
+
+
+_search_xpath = etree.XPath('//*[{}]/descendant-or-self::*/@*'.format(_has_class('search-title')))
+_search_url = re.compile(r'url=([^&"]*)')
+
+
+def search_links(source):
+    """
+    Find the articles' links in a search result page.
+    Only the attributes under the 'search-title' elements are scanned.
+
+    :param source: the source code of the search page, or the undecoded response body
+    :returns: a list of URLs
+    """
+    root = _parse(source)
+    if root is None:
+        return []
+    links = []
+    for value in _search_xpath(root):
+        links.extend(unquote(l) for l in _search_url.findall(value))
+    return links
@@ -0,0 +1,223 @@
+import re
+import time
+import asyncio
+import collections
+from urllib.parse import urlsplit
+
+
+# the second-level suffixes under which a domain has three labels, e.g. 'example.com.tw'
+_second_levels = {'com', 'net', 'org', 'edu', 'gov', 'co', 'ac', 'idv'}
+_ip_re = re.compile(r'^[\d.]+$|:')
+
+
+def domain(url):
+    """
+    The registrable domain of a URL, e.g. 'pixnet.net' for
+    'https://someone.pixnet.net/blog/post/1', so all blogs of a site are
+    limited and reported together. IP addresses are kept as they are.
+    """
+    host = urlsplit(url).hostname or ''
+    if _ip_re.search(host):
+        return host
+    labels = host.split('.')
+    n = 3 if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in _second_levels else 2
+    return '.'.join(labels[-n:])
+
+
+class TokenBucket:
+    """
+    A token bucket to cap the request rate.
+    Tokens are refilled at 'rate' per second, up to 'burst' tokens.
+    """
+
+    def __init__(self, rate, burst=None):
+        self._rate = rate
+        self._burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class AIMDLimiter:
+    """
+    An adaptive concurrency limit for a host, or a host through a proxy.
+
+    The limit grows additively (about one more connection for each round of
+    successful requests) and is cut multiplicatively when a request fails
+    (429, 5xx or no response) or its latency exceeds 'latency_factor' times
+    the fastest latency observed. The limit is cut at most once per smoothed
+    latency, so a burst of failures from the same congestion only counts once.
+    """
+
+    def __init__(self, initial=16, minimum=1, maximum=1000, backoff=0.5, latency_factor=4.0, rate=None):
+        self._limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._backoff = backoff
+        self._latency_factor = latency_factor
+        self._bucket = TokenBucket(rate) if rate else None
+        self._inflight = 0
+        self._waiters = collections.deque()
+        self._min_latency = None
+        self._avg_latency = None
+        self._last_cut = 0.0
+        self._requests = 0
+        self._errors = 0
+
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+
+    @property
+    def requests(self):
+        return self._requests
+
+
+    @property
+    def errors(self):
+        return self._errors
+
+
+    async def acquire(self):
+        while self._inflight >= int(self._limit):
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    self._wake()    # pass the slot to the next waiter
+                raise
+        self._inflight += 1
+        if self._bucket is not None:
+            try:
+                await self._bucket.take()
+            except BaseException:
+                self.discard()
+                raise
+
+
+    def discard(self):
+        """
+        Free a slot without a request being sent.
+        """
+        self._inflight -= 1
+        self._wake()
+
+
+    def release(self, latency, error):
+        """
+        Free a slot and adjust the limit according to the outcome.
+
+        :param latency: the seconds spent on the request
+        :param error: True if the request failed
+        """
+        self._inflight -= 1
+        self._requests += 1
+        now = time.monotonic()
+        if self._min_latency is None or latency < self._min_latency:
+            self._min_latency = latency
+        self._avg_latency = latency if self._avg_latency is None else 0.8 * self._avg_latency + 0.2 * latency
+
+        slow = latency > self._latency_factor * max(self._min_latency, 0.05)
+        if error:
+            self._errors += 1
+        if error or slow:
+            if now - self._last_cut > self._avg_latency:
+                self._limit = max(self._minimum, self._limit * self._backoff)
+                self._last_cut = now
+        else:
+            self._limit = min(self._maximum, self._limit + 1 / self._limit)
+        self._wake()
+
+
+    def _wake(self):
+        free = int(self._limit) - self._inflight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class _Slot:
+    """
+    The context of a request holding a slot of a limiter.
+    Set 'status' to the HTTP status code before leaving the context.
+    """
+
+    def __init__(self, host_limiter, key):
+        self._host_limiter = host_limiter
+        self._key = key
+        self._start = 0
+        self.status = 0
+
+
+    async def __aenter__(self):
+        limiter = self._host_limiter._limiter(self._key)
+        await limiter.acquire()
+        try:
+            await self._host_limiter._semaphore.acquire()
+        except BaseException:
+            limiter.discard()
+            raise
+        self._start = time.monotonic()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        error = exc_type is not None or self.status == 0 or self.status == 429 or self.status >= 500
+        self._host_limiter._limiter(self._key).release(time.monotonic() - self._start, error)
+        self._host_limiter._semaphore.release()
+
+
+class HostLimiter:
+    """
+    The concurrency control of the crawler.
+    Each pair of (domain, proxy) gets its own AIMD limiter, so a slow site or
+    proxy won't hold back the others. The blogs on the subdomains of a site
+    share the limiter of the site, since they are served by the same
+    servers. The total number of connections is
+    still bounded by 'maximum' to avoid the limitation of open files.
+    """
+
+    def __init__(self, maximum=1000, initial=16, rate=None):
+        self._maximum = maximum
+        self._initial = initial
+        self._rate = rate
+        self._semaphore = asyncio.Semaphore(maximum)
+        self._limiters = {}
+
+
+    def _limiter(self, key):
+        if key not in self._limiters:
+            self._limiters[key] = AIMDLimiter(self._initial, maximum=self._maximum, rate=self._rate)
+        return self._limiters[key]
+
+
+    def slot(self, url, proxy=None):
+        """
+        :returns: an async context manager holding a slot for the request
+        """
+        return _Slot(self, (domain(url), proxy))
+
+
+    def report(self):
+        print('Concurrency limits:')
+        for (host, proxy), limiter in sorted(self._limiters.items(), key=lambda item: -item[1].requests):
+            name = str(host) + (' via ' + proxy if proxy else '')
+            print('{:50}{}{:>6}{:>8} requests{:>6} errors'.format(name, '| ', limiter.limit, limiter.requests, limiter.errors))
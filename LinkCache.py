@@ -0,0 +1,79 @@
+import time
+import sqlite3
+
+
+class LinkCache:
+    """
+    The real article URLs of the Hares links.
+
+    A Hares link always leads to the same article, so a link resolved once
+    never needs to be requested again. The links are kept in memory, and in
+    a SQLite database if a filename is given, so they're also kept between
+    the runs. The new links are committed every 100 links and on 'commit'.
+    """
+
+    def __init__(self, filename=None):
+        self._filename = filename
+        self._links = {}
+        self._pending = 0
+        self._hits = 0
+        self._misses = 0
+        self._db = None
+        if filename:
+            self._db = sqlite3.connect(filename)
+            self._db.execute('CREATE TABLE IF NOT EXISTS links (url TEXT PRIMARY KEY, link TEXT, resolved_at REAL)')
+            self._links = dict(self._db.execute('SELECT url, link FROM links'))
+
+
+    @property
+    def filename(self):
+        return self._filename
+
+
+    @property
+    def hits(self):
+        return self._hits
+
+
+    @property
+    def misses(self):
+        return self._misses
+
+
+    def get(self, url):
+        """
+        :returns: the real article URL, None if it's not resolved yet
+        """
+        link = self._links.get(url)
+        if link is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return link
+
+
+    def put(self, url, link):
+        self._links[url] = link
+        if self._db is None:
+            return
+        self._db.execute('INSERT OR REPLACE INTO links VALUES (?, ?, ?)', (url, link, time.time()))
+        self._pending += 1
+        if self._pending >= 100:
+            self.commit()
+
+
+    def commit(self):
+        if self._db is not None and self._pending:
+            self._db.commit()
+            self._pending = 0
+
+
+    def close(self):
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+    def report(self):
+        print('Hares links: {} from the cache, {} resolved'.format(self._hits, self._misses))
@@ -0,0 +1,213 @@
+import json
+import bisect
+from aiohttp import web
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets, like the ones of Prometheus.
+    Only the counts of the buckets are kept, so observing a value is cheap
+    and the memory usage doesn't grow with the number of requests.
+    """
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)     # the last one is +Inf
+        self._count = 0
+        self._sum = 0.0
+
+
+    @property
+    def count(self):
+        return self._count
+
+
+    @property
+    def sum(self):
+        return self._sum
+
+
+    @classmethod
+    def merged(cls, histograms):
+        """
+        :param histograms: the histograms with the same buckets
+        :returns: a histogram of all values observed by them
+        """
+        histograms = list(histograms)
+        result = cls(histograms[0]._buckets if histograms else Metrics.latency_buckets)
+        for h in histograms:
+            result._counts = [a + b for a, b in zip(result._counts, h._counts)]
+            result._count += h._count
+            result._sum += h._sum
+        return result
+
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._count += 1
+        self._sum += value
+
+
+    def cumulative(self):
+        """
+        :returns: a list of tuples of (upper bound, cumulative count)
+        """
+        result = []
+        total = 0
+        for bound, n in zip(list(self._buckets) + [float('inf')], self._counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by interpolating within its bucket.
+
+        :param q: a number between 0 and 1
+        """
+        if self._count == 0:
+            return 0.0
+        rank = q * self._count
+        lower = 0.0
+        previous = 0
+        for bound, total in self.cumulative():
+            if total >= rank:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (rank - previous) / max(total - previous, 1)
+            lower, previous = bound, total
+        return lower
+
+
+    def to_dict(self):
+        return {'count': self._count, 'sum': round(self._sum, 6),
+                'p50': round(self.quantile(0.5), 6), 'p95': round(self.quantile(0.95), 6),
+                'buckets': {('+Inf' if bound == float('inf') else str(bound)): n for bound, n in self.cumulative()}}
+
+
+class Metrics:
+    """
+    The metrics of the crawling: counters, gauges and histograms, each
+    with a name and a tuple of (label, value) pairs.
+
+    The metrics can be saved as a JSON summary, and served in the text
+    format of Prometheus at '/metrics' for live scraping.
+    """
+
+    latency_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60)
+    prefix = 'pixnet_'
+
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._runner = None
+
+
+    def inc(self, name, labels=(), value=1):
+        counter = self._counters.setdefault(name, {})
+        counter[labels] = counter.get(labels, 0) + value
+
+
+    def set(self, name, value, labels=()):
+        self._gauges.setdefault(name, {})[labels] = value
+
+
+    def observe(self, name, value, labels=(), buckets=None):
+        histograms = self._histograms.setdefault(name, {})
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = Histogram(buckets or self.latency_buckets)
+        histogram.observe(value)
+
+
+    def counter(self, name):
+        """
+        :returns: a dictionary of {labels: value}
+        """
+        return self._counters.get(name, {})
+
+
+    def histogram(self, name):
+        """
+        :returns: a dictionary of {labels: Histogram}
+        """
+        return self._histograms.get(name, {})
+
+
+    def to_dict(self):
+        def series(metrics, value):
+            return {name: [dict(labels, value=value(v)) for labels, v in items.items()]
+                    for name, items in metrics.items()}
+        return {'counters': series(self._counters, lambda v: v),
+                'gauges': series(self._gauges, lambda v: v),
+                'histograms': series(self._histograms, Histogram.to_dict)}
+
+
+    def save(self, filename):
+        with open(filename, 'w', encoding='UTF-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+    def prometheus(self):
+        """
+        :returns: the metrics in the text format of Prometheus
+        """
+        lines = []
+        for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+            for name, items in sorted(metrics.items()):
+                lines.append('# TYPE {}{} {}'.format(self.prefix, name, kind))
+                for labels, value in items.items():
+                    lines.append('{}{}{} {}'.format(self.prefix, name, _labels(labels), value))
+        for name, items in sorted(self._histograms.items()):
+            lines.append('# TYPE {}{} histogram'.format(self.prefix, name))
+            for labels, histogram in items.items():
+                for bound, n in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append('{}{}_bucket{} {}'.format(self.prefix, name, _labels(labels + (('le', le),)), n))
+                lines.append('{}{}_sum{} {}'.format(self.prefix, name, _labels(labels), histogram.sum))
+                lines.append('{}{}_count{} {}'.format(self.prefix, name, _labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+    async def serve(self, port, host='0.0.0.0'):
+        """
+        Serve the metrics at 'http://host:port/metrics' until 'stop' is called.
+        """
+        async def handle(request):
+            return web.Response(text=self.prometheus(), content_type='text/plain')
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+    def report(self):
+        print('Requests:')
+        for labels, histogram in sorted(self.histogram('request_seconds').items()):
+            name = ' '.join(str(v) for k, v in labels)
+            print('{:50}{}{:>8} requests  p50 {:.3f}s  p95 {:.3f}s'.format(
+                  name, '| ', histogram.count, histogram.quantile(0.5), histogram.quantile(0.95)))
+        statuses = {}
+        for labels, n in self.counter('responses').items():
+            status = dict(labels)['status']
+            statuses[status] = statuses.get(status, 0) + n
+        print('Status codes: ' + ', '.join('{}: {}'.format(s, n) for s, n in sorted(statuses.items())))
+        print('Downloaded: {:.2f} MB, {} retries'.format(
+              sum(self.counter('bytes').values()) / 2**20, sum(self.counter('retries').values())))
+        for labels, histogram in self.histogram('parse_seconds').items():
+            print('Parsing: {} articles, {:.3f}s on average'.format(histogram.count, histogram.sum / max(histogram.count, 1)))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
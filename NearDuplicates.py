@@ -0,0 +1,102 @@
+import re
+import hashlib
+from collections import Counter
+
+
+class NearDuplicates:
+    """
+    A streaming filter of the near-duplicate articles, by SimHash.
+
+    Each article gets a 64-bit fingerprint from the character shingles of
+    its text, and two articles are near-duplicates if their fingerprints
+    differ in at most 'distance' bits. The fingerprints are split into
+    'distance + 1' bands, and two near-duplicates always share one band
+    exactly, so an article is only compared with the ones sharing a band
+    with it instead of all articles seen so far.
+    """
+
+    bits = 64
+
+    def __init__(self, distance=3, shingle=4):
+        """
+        :param distance: the maximum number of different bits of two near-duplicates
+        :param shingle: the characters in each shingle
+        """
+        if not 0 <= distance < 16:
+            raise ValueError('The distance needs to be between 0 and 15, got {}'.format(distance))
+        self._distance = distance
+        self._shingle = shingle
+        self._word_re = re.compile(r'\W+')
+        bands = distance + 1
+        edges = [self.bits * i // bands for i in range(bands + 1)]
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]    # (shift, mask)
+        self._index = [{} for _ in self._bands]     # {band value: [fingerprints]} of each band
+        self._kept = 0
+        self._dropped = 0
+
+
+    @property
+    def distance(self):
+        return self._distance
+
+
+    @property
+    def kept(self):
+        return self._kept
+
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+
+    def fingerprint(self, text):
+        """
+        :returns: the SimHash of the text, None if there's no word in it
+        """
+        text = self._word_re.sub('', text)
+        if not text:
+            return None
+        n = self._shingle
+        shingles = {text[i:i + n] for i in range(max(len(text) - n + 1, 1))}
+        digests = b''.join(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest() for s in shingles)
+        # count the set bits byte by byte, so the bits of each shingle aren't visited one by one
+        half = len(shingles) / 2
+        result = 0
+        for position in range(8):
+            votes = [0] * 8
+            for byte, count in Counter(digests[position::8]).items():
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        votes[bit] += count
+            for bit in range(8):
+                if votes[bit] > half:
+                    result |= 1 << (position * 8 + bit)
+        return result
+
+
+    def is_duplicate(self, text):
+        """
+        Check an article against the ones seen so far, and remember it if
+        it's not a near-duplicate of them.
+
+        :returns: True if the article is a near-duplicate of an earlier one
+        """
+        fingerprint = self.fingerprint(text)
+        if fingerprint is None:
+            self._kept += 1
+            return False
+        keys = [fingerprint >> shift & mask for shift, mask in self._bands]
+        for index, key in zip(self._index, keys):
+            for other in index.get(key, ()):
+                if bin(fingerprint ^ other).count('1') <= self._distance:
+                    self._dropped += 1
+                    return True
+        for index, key in zip(self._index, keys):
+            index.setdefault(key, []).append(fingerprint)
+        self._kept += 1
+        return False
+
+
+    def report(self):
+        print('Near-duplicates: {} dropped, {} kept (distance {})'.format(self._dropped, self._kept, self._distance))
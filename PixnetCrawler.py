@@ -1,15 +1,31 @@
+import os
 import re
+import copy
+import json
+import random
 import time
 import sys
+import socket
+import logging
 import argparse
 import asyncio
-import aiohttp
+import multiprocessing
 import ProxyPool
+import Extractor
+import ResponseCache
+import CrawlState
+import HostLimiter
+import SessionManager
+import WorkQueue
+import RecordWriter
+import Metrics
+import LinkCache
+import NearDuplicates
 import html2text
 from bs4 import BeautifulSoup
-from urllib.parse import unquote
+from concurrent.futures import ProcessPoolExecutor
 
-ordinal = {1: 'first', 2: 'second', 3: 'third', 4: 'fourth', 5: 'fifth', 6: 'sixth', 7: 'seventh', 8: 'eighth', 9: 'ninth', 10: 'tenth'}
+logger = logging.getLogger('PixnetCrawler')
 
 class PixnetCrawler:
     """
@@ -34,6 +50,7 @@ class PixnetCrawler:
         self._re_urls = []
         self._pool = ProxyPool.ProxyPool()
         self._searchURL = ''
+        self._search_site = 'https://www.pixnet.net'
         self._punc = ',.!?:;~\'\"，。！？：；、～…⋯()<>「」［］【】＜＞〈〉《》（）﹙﹚『』«»“”’{}\\[\\]'   # the '[]' needs to be the last one
         self._stop_words = 'ㄅㄆㄇㄈㄉㄊㄋㄌㄍㄎㄏㄐㄑㄒㄓㄔㄕㄖㄗㄘㄙㄧㄨㄩㄚㄛㄜㄝㄞㄟㄠㄡㄢㄣㄤㄥㄦ \
                             ａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ \
@@ -42,12 +59,61 @@ class PixnetCrawler:
                             ()_+=-\\[]/,.;:`~|{}<>\'\"\n\t\r\xa0，。、！？「」［］【】＜＞〈〉《》（）：；«»＊˙●／＿—『』×＠＃＄％︿＆－＝〜～≡｜│║★☆Ⓡ➠†§– \
                             ♥❤“”’￣▽😊😆😋😏😅😀😍😎📍👍🚫🐍💟🎉⊙◢◤˚ﾟ･｡｀↑↓﹙﹚▲▼◆◈▣✥▒👉►⓪①②③④⑤⑥⑦⑧⑨⑩⑪⑫⑬〝〞▌☀ღ▶➦ⓞ☎▋♡▂▃▄▅▆▊▩⇓✽�🕘㊣╳'
         self._sw_no_punc = re.sub('([{}])'.format(self._punc), '', self._stop_words)
-        self._sw_dict = {w : True for w in self._stop_words}
-        self._sw_no_punc_dict = {w : True for w in self._sw_no_punc}
+        self._norm_table = self._build_norm_table()
+        self._norm_re = re.compile('，{2,}')
         self._websites = {'Unknown': -1, 'Pixnet': 0, 'Hares': 1}
+        self._site_names = {v: k for k, v in self._websites.items()}
         self._title_tags = ['title', 'entry-title']                       # {0: 'Pixnet', 1: 'Hares}
         self._content_tags = ['article-content-inner', 'entry-content']   # {0: 'Pixnet', 1: 'Hares}
-        self._result = ''
+        self._extractors = {site: Extractor.XPathExtractor(title, content)
+                            for site, (title, content) in enumerate(zip(self._title_tags, self._content_tags))}
+        self._result = []
+        self._stream = False
+        self._writer = None
+        self._tail = ''     # the last character of the normalized output so far
+        self._pipeline = False
+        self._queue_size = 1000
+        self._concurrency = 1000
+        self._parser = 'inline'
+        self._workers = os.cpu_count() or 1
+        self._executor = None
+        self._cache = None
+        self._state = None
+        self._incremental = False
+        self._append = False
+        self._done_num = 0
+        self._limiter = None
+        self._initial_limit = 16
+        self._rate = None
+        self._sessions = None
+        self._limit_per_host = 0
+        self._dns_ttl = 300
+        self._keepalive = 30
+        self._proxy_revalidate = 0
+        self._base_backoff = 1
+        self._max_backoff = 30
+        self._jobs = []
+        self._output_dir = ''
+        self._batch = None      # the crawlers of the keywords in batch mode
+        self._shared = None     # {url: future of (status, text)} shared by the batch
+        self._queue_file = ''
+        self._shards = 0
+        self._lease_size = 100
+        self._lease_time = 120
+        self._records_file = ''
+        self._records = None
+        self._metrics = Metrics.Metrics()
+        self._metrics_file = ''
+        self._metrics_port = None
+        self._hares_re = re.compile(r'(http://hares.tw/archives/.*?)\">繼續閱讀全文'.encode('utf-8'))
+        self._hares_cache = LinkCache.LinkCache()
+        self._auto_pages = 0      # the window of auto pagination, 0 for off
+        self._sink = None         # the queue of the records for 'iter_articles'
+        self._sink_size = 100
+        self._sink_fetching = 0
+        self._sink_room = None
+        self._dedup_distance = None     # the SimHash distance of near-duplicates, None for off
+        self._dedup = None
 
 
     @property
@@ -80,6 +146,116 @@ class PixnetCrawler:
         return self._filename
 
 
+    @property
+    def stream(self):
+        return self._stream
+
+
+    @property
+    def pipeline(self):
+        return self._pipeline
+
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+
+    @property
+    def parser(self):
+        return self._parser
+
+
+    @property
+    def workers(self):
+        return self._workers
+
+
+    @property
+    def incremental(self):
+        return self._incremental
+
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+
+    @property
+    def rate(self):
+        return self._rate
+
+
+    @property
+    def limit_per_host(self):
+        return self._limit_per_host
+
+
+    @property
+    def dns_ttl(self):
+        return self._dns_ttl
+
+
+    @property
+    def keepalive(self):
+        return self._keepalive
+
+
+    @property
+    def proxy_revalidate(self):
+        return self._proxy_revalidate
+
+
+    @property
+    def output_dir(self):
+        return self._output_dir
+
+
+    @property
+    def queue_file(self):
+        return self._queue_file
+
+
+    @property
+    def shards(self):
+        return self._shards
+
+
+    @property
+    def lease_size(self):
+        return self._lease_size
+
+
+    @property
+    def lease_time(self):
+        return self._lease_time
+
+
+    @property
+    def records_file(self):
+        return self._records_file
+
+
+    @property
+    def metrics_file(self):
+        return self._metrics_file
+
+
+    @property
+    def metrics_port(self):
+        return self._metrics_port
+
+
+    @property
+    def auto_pages(self):
+        return self._auto_pages
+
+
+    @property
+    def dedup(self):
+        return self._dedup_distance
+
+
     @start.setter
     def start(self, value):
         self._start = value
@@ -110,17 +286,234 @@ class PixnetCrawler:
         self._filename = value
 
 
+    @stream.setter
+    def stream(self, value):
+        self._stream = value
+
+
+    @pipeline.setter
+    def pipeline(self, value):
+        self._pipeline = value
+
+
+    @queue_size.setter
+    def queue_size(self, value):
+        self._queue_size = value
+
+
+    @parser.setter
+    def parser(self, value):
+        self._parser = value
+
+
+    @workers.setter
+    def workers(self, value):
+        self._workers = value
+
+
+    @incremental.setter
+    def incremental(self, value):
+        self._incremental = value
+
+
+    @concurrency.setter
+    def concurrency(self, value):
+        self._concurrency = value
+
+
+    @rate.setter
+    def rate(self, value):
+        self._rate = value
+
+
+    @limit_per_host.setter
+    def limit_per_host(self, value):
+        self._limit_per_host = value
+
+
+    @dns_ttl.setter
+    def dns_ttl(self, value):
+        self._dns_ttl = value
+
+
+    @keepalive.setter
+    def keepalive(self, value):
+        self._keepalive = value
+
+
+    @proxy_revalidate.setter
+    def proxy_revalidate(self, value):
+        self._proxy_revalidate = value
+
+
+    @output_dir.setter
+    def output_dir(self, value):
+        self._output_dir = value
+
+
+    @queue_file.setter
+    def queue_file(self, value):
+        self._queue_file = value
+
+
+    @shards.setter
+    def shards(self, value):
+        self._shards = value
+
+
+    @lease_size.setter
+    def lease_size(self, value):
+        self._lease_size = value
+
+
+    @lease_time.setter
+    def lease_time(self, value):
+        self._lease_time = value
+
+
+    @records_file.setter
+    def records_file(self, value):
+        self._records_file = value
+
+
+    @metrics_file.setter
+    def metrics_file(self, value):
+        self._metrics_file = value
+
+
+    @metrics_port.setter
+    def metrics_port(self, value):
+        self._metrics_port = value
+
+
+    @auto_pages.setter
+    def auto_pages(self, value):
+        self._auto_pages = value
+
+
+    @dedup.setter
+    def dedup(self, value):
+        self._dedup_distance = value
+
+
+    def set_proxy_selection(self, value):
+        self._pool.selection = value
+
+
+    def use_proxy_snapshot(self, filename, ttl=1800):
+        """
+        Keep the proxy pool in a file between the runs, so a crawling right
+        after another one starts without testing the proxies again.
+
+        :param filename: the snapshot file
+        :param ttl: the seconds for a saved proxy to be used without testing
+        """
+        self._pool.use_snapshot(filename, ttl)
+
+
+    def _build_norm_table(self):
+        """
+        Build the translation table for '_normalize'.
+        The stop words and whitespaces are deleted, and the symbols specified
+        in '_punc' are mapped to '，'. A list is used instead of a dictionary
+        since it's much faster to look up in 'str.translate'.
+
+        :returns: a list
+        """
+        whitespaces = ''.join(filter(str.isspace, map(chr, range(0x3001))))   # all whitespaces are below U+3001
+        mapping = {ord(w): None for w in self._sw_no_punc + whitespaces}
+        mapping.update({ord(p): '，' for p in self._punc.replace('\\', '')})  # drop the escapes of '[]'
+        table = list(range(max(mapping) + 1))
+        for k, v in mapping.items():
+            table[k] = v
+        return table
+
+
+    def _get_limiter(self):
+        """
+        The limiter is shared by all connections of the crawling, so the
+        limits learned for each host are kept between the phases.
+        """
+        if self._limiter is None:
+            self._limiter = HostLimiter.HostLimiter(self._concurrency, self._initial_limit, self._rate)
+        return self._limiter
+
+
+    def _get_sessions(self):
+        """
+        The session manager is created on the first request and shared with
+        the proxy pool, so all connections of the crawling are pooled.
+        """
+        if self._sessions is None:
+            self._sessions = SessionManager.SessionManager(self._timeout, self._limit_per_host, self._dns_ttl, self._keepalive)
+            self._pool.sessions = self._sessions
+        return self._sessions
+
+
+    async def close(self):
+        """
+        Close the shared sessions and the metrics endpoint.
+        """
+        await self._metrics.stop()
+        self._hares_cache.commit()
+        if self._cache is not None:
+            self._cache.commit()
+        await self._pool.stop_revalidation()
+        self._pool.save_snapshot()
+        if self._sessions is not None:
+            await self._sessions.close()
+
+
+    def use_cache(self, filename, ttl=86400, max_size=512 * 2**20):
+        """
+        Cache the responses on the disk, so the pages crawled recently
+        won't be downloaded again.
+
+        :param filename: the cache database
+        :param ttl: the seconds for a response to be used without revalidation
+        :param max_size: the maximum bytes of the compressed responses
+        """
+        self._cache = ResponseCache.ResponseCache(filename, ttl, max_size)
+
+
+    def use_hares_cache(self, filename):
+        """
+        Keep the real article URLs of the Hares links on the disk, so they're
+        never resolved again by the later crawlings.
+
+        :param filename: the database of the links
+        """
+        self._hares_cache = LinkCache.LinkCache(filename)
+
+
+    def use_state(self, filename):
+        """
+        Record the progress of the crawling, so an interrupted crawling can
+        be resumed, and the articles crawled before can be skipped in
+        incremental mode.
+
+        :param filename: the state database
+        """
+        self._state = CrawlState.CrawlState(filename)
+
+
     def set_searchURL(self):
-        self._searchURL = 'https://www.pixnet.net/searcharticle?q={:s}&page='.format(self._keyword.replace(' ', '+'))
+        self._searchURL = '{}/searcharticle?q={:s}&page='.format(self._search_site, self._keyword.replace(' ', '+'))
 
 
-    async def _fetch(self, session, url, proxy=None, raw=False, which_site=False):
+    async def _fetch(self, url, proxy=None, raw=False, which_site=False, limiter=None):
         """
         Issue a GET request for the given URL.
+        Each attempt holds a slot of the limiter of its site and proxy, and
+        reports the outcome back, so the concurrency adapts to the server.
+        The request is sent through the shared session of the proxy.
 
+        :param raw: False to get the soup object, True to get the source code,
+                    'bytes' to get the undecoded response body
+        :param limiter: a HostLimiter object, None for no limitation
         :returns: a tuple
         """
-        print(url)
+        logger.debug(url)
         result = None
         site = None
         if 'hare' in url:   # {'Unknown': -1, 'Pixnet': 0, 'Hares': 1}
@@ -130,19 +523,49 @@ class PixnetCrawler:
         else:
             site = self._websites['Unknown']
 
+        cached = self._cache.get(url) if self._cache is not None else None
+        if cached is not None and cached[2]:     # fresh in the cache
+            body, status = cached[:2]
+            self._metrics.inc('cache_hits', (('phase', _phase(url)),))
+            soup = self._decode(body, raw)
+            return (url, soup, status, site) if which_site else (url, soup, status)
+        headers = cached[3] if cached is not None else None    # revalidate the stale one
+
         count = 1
         while count <= 2:
             soup = ''
             status = 0
+            size = 0
+            sent = None
+            cancelled = False
             try:
-                async with session.get(url, proxy=proxy) as response:
-                    source_code = await response.text('utf-8')
-                    status = response.status
-                    soup = source_code if raw else BeautifulSoup(source_code, 'lxml')
+                async with self._slot(limiter, url, proxy) as slot:
+                    sent = time.monotonic()
+                    async with self._get_sessions().session(proxy).get(url, proxy=proxy, headers=headers) as response:
+                        slot.status = code = response.status
+                        body = None if code == 304 and cached is not None else await response.read()
+                # the cache is written after the slot is released
+                if body is None:
+                    body, code = cached[:2]
+                    self._cache.refresh(url)
+                else:
+                    size = len(body)
+                    if self._cache is not None and code == 200:
+                        self._cache.put(url, body, code, response.headers)
+                soup = self._decode(body, raw)
+                status = code
+            except asyncio.CancelledError:
+                cancelled = True    # e.g. stopped by the user, not the proxy's fault
+                raise
             except Exception as e:
-                print('Connection error: ' + str(e))
+                logger.info('Connection error: ' + str(e) + ' | ' + url)
                 soup = None
             finally:
+                if not cancelled:
+                    ok = status != 0 and status != 429 and status < 500
+                    if sent is not None:    # the time waiting for the limiter is not the proxy's latency
+                        self._pool.report(proxy, ok, time.monotonic() - sent)
+                    self._observe(url, proxy, status, ok, sent, size)
                 result = (url, soup, status, site) if which_site else (url, soup, status)
                 if status != 0:
                     return result
@@ -152,35 +575,66 @@ class PixnetCrawler:
         return result
 
 
-    async def _bound_fetch(self, semaphore, session, url, proxy=None, raw=False, which_site=False):
+    def _observe(self, url, proxy, status, ok, sent, size):
+        """
+        Record the metrics of a request.
+
+        :param sent: the time the request was sent, None if it never was
+        :param size: the bytes downloaded
         """
-        To set up a boundary for the open files limitation at the same time.
+        phase = _phase(url)
+        if sent is not None:
+            self._metrics.observe('request_seconds', time.monotonic() - sent,
+                                  (('phase', phase), ('host', HostLimiter.domain(url))))
+        self._metrics.inc('responses', (('phase', phase), ('status', status)))
+        self._metrics.inc('bytes', (('phase', phase),), size)
+        self._metrics.inc('proxy_requests', (('proxy', proxy or 'direct'), ('outcome', 'ok' if ok else 'error')))
+
+
+    def _decode(self, body, raw):
+        """
+        Convert a response body to the type requested by '_fetch'.
+        """
+        if raw == 'bytes':
+            return body
+        source_code = body.decode('utf-8')
+        return source_code if raw else BeautifulSoup(source_code, 'lxml')
+
+
+    def _slot(self, limiter, url, proxy):
+        if limiter is None:
+            return _NoSlot()
+        return limiter.slot(url, proxy)
+
+
+    async def _bound_fetch(self, limiter, url, proxy=None, raw=False, which_site=False):
+        """
+        To set up a boundary for the concurrency of each host and the open
+        files limitation at the same time.
         
         :returns: a tuple
         """
-        async with semaphore:
-            return await self._fetch(session, url, proxy, raw, which_site)
+        return await self._fetch(url, proxy, raw, which_site, limiter)
 
 
     async def _connect(self, urls, proxy=None, raw=False, which_site=False):
         """
         Create a list of connection tasks.
 
-        :param session: a aiohttp's ClientSession object
-        :param url: the request url
+        :param urls: the request urls
         :param proxy: the proxy's url, none if using local IP address
-        :param raw: True to get the source code, False to get the soup object of Beautifulsoup
+        :param raw: True to get the source code, False to get the soup object of Beautifulsoup,
+                    'bytes' to get the undecoded response body
         :param which_site: True to add a column in result to specify the types of websites
         :returns: a list of tuples
         e.g. [(url, soup, status), (url, soup, status)]
         """
         tasks = []
-        semaphore = asyncio.Semaphore(1000)   # use Semaphore to avoid limitation number of Windows open files
-        async with aiohttp.ClientSession(read_timeout=self._timeout) as session:   # read_timeout is the acceptable time
-            for url in urls:                                                       # for waiting for the server's response
-                task = asyncio.ensure_future(self._bound_fetch(semaphore, session, url, proxy, raw, which_site))
-                tasks.append(task)
-            await asyncio.gather(*tasks)
+        limiter = self._get_limiter()
+        for url in urls:
+            task = asyncio.ensure_future(self._bound_fetch(limiter, url, proxy, raw, which_site))
+            tasks.append(task)
+        await asyncio.gather(*tasks)
         return [task.result() for task in tasks]
 
 
@@ -188,19 +642,19 @@ class PixnetCrawler:
         """
         Check if error exists during connection.
         If there's an error, the type of error will be specified,
-        and the error URL will be added into a reconnection queue.
+        and the error URL will be added into the failed list.
 
         :param log_url: True to log the URLs to '_re_urls' with connection errors
         :returns: True if no error exists, else False
         """
         unexpect = False
         if status == 0:
-            print('Unable to connect to website: ' + url)
+            logger.info('Unable to connect to website: ' + url)
         elif status >= 400 or soup is None:
-            print(str(status) + ' | Can\'t open website: ' + url)
+            logger.info(str(status) + ' | Can\'t open website: ' + url)
         else:
             if site < 0:
-                print('Unexpected website: ' + url)
+                logger.warning('Unexpected website: ' + url)
                 unexpect = True
             else:
                 return False    # No error
@@ -216,16 +670,81 @@ class PixnetCrawler:
         :param urls: the Hares URLs list
         :returns: a list of Hares URLs
         """
-        transformed_links = []
-        result_list = await self._connect(urls, raw=True)
-        for result in result_list:
-            url, source_code = result[:2]
-            link = re.findall(r'(http://hares.tw/archives/.*?)\">繼續閱讀全文', source_code)
-            if link:
-                transformed_links.append(link[0])
-            else:    # list is empty
-                transformed_links.append(url)
-        return transformed_links
+        limiter = self._get_limiter()
+        return await asyncio.gather(*[self._resolve_hares(limiter, url) for url in urls])
+
+
+    async def _resolve_hares(self, limiter, url):
+        """
+        Find the real article URL of a Hares link.
+        The page is read in chunks and the connection is closed as soon as
+        the link shows up, so the rest of the page is never downloaded. The
+        links resolved are kept in '_hares_cache' and never requested again.
+
+        :returns: the real article URL, or the given URL if it's not found
+        """
+        link = self._hares_cache.get(url)
+        if link is not None:
+            return link
+        logger.debug(url)
+        for attempt in range(2):    # once more if there's no response, like '_fetch'
+            status = 0
+            size = 0
+            sent = None
+            try:
+                async with self._slot(limiter, url, None) as slot:
+                    sent = time.monotonic()
+                    async with self._get_sessions().session().get(url) as response:
+                        slot.status = status = response.status
+                        link, size = await self._scan_hares(response)
+            except Exception as e:
+                logger.info('Connection error: ' + str(e) + ' | ' + url)
+            finally:
+                self._observe(url, None, status, status != 0 and status != 429 and status < 500, sent, size)
+            if status != 0:
+                break
+        self._metrics.inc('hares_links', (('outcome', 'missing' if link is None else 'resolved'),))
+        if link is None:
+            return url
+        self._hares_cache.put(url, link)
+        return link
+
+
+    async def _scan_hares(self, response):
+        """
+        Read a Hares page until the real article URL is found.
+        Only the last 4 KB of the page read so far is kept with each chunk,
+        since the link may cross the chunks.
+
+        :returns: a tuple of (the URL or None, the bytes read)
+        """
+        tail = b''
+        size = 0
+        async for chunk in response.content.iter_any():
+            size += len(chunk)
+            buffer = tail + chunk
+            match = self._hares_re.search(buffer)
+            if match:
+                response.close()     # drop the rest of the page and the connection
+                return match.group(1).decode('utf-8'), size
+            tail = buffer[-4096:]
+        return None, size
+
+
+    def _search_links(self, source_code):
+        """
+        Find the articles' links in a search result page.
+
+        :returns: a tuple of two lists, the Pixnet URLs and the Hares URLs
+        """
+        links = []
+        hares_links = []
+        for l in Extractor.search_links(source_code):
+            if 'hare48.pixnet.net' in l:
+                hares_links.append(l)
+            else:
+                links.append(l)
+        return links, hares_links
 
 
     async def get_article_links(self):
@@ -234,193 +753,1254 @@ class PixnetCrawler:
 
         :returns: a list of URLs
         """
-        urls = []
-        for page in range(self._start, self._end+1):
-            urls.append(self._searchURL + str(page))
-        result_list = await self._connect(urls)
+        limiter = self._get_limiter()
+        results = {}
+
+        async def fetch(page):
+            source_code, status = await self._fetch_search(limiter, page)
+            results[page] = (source_code, status) + self._search_links(source_code)
+            return self._link_count(status, results[page][2] + results[page][3])
+        await self._search_pages(fetch)
 
         self._urls = []
         hares_links = []
-        for result in result_list:
-            soup = result[1]
-            search_links = soup.find_all(class_='search-title')
-            article_links = re.findall(r'url=(.*?)\"', str(search_links))
-            for l in article_links:
-                l = unquote(l)
-                if 'hare48.pixnet.net' in l:
-                    hares_links.append(l)
-                else:
-                    self._urls.append(l)
+        for l in self._resumed_links():
+            (hares_links if 'hare48.pixnet.net' in l else self._urls).append(l)
+        for page in sorted(results):
+            source_code, status, links, hares = results[page]
+            self._record_page(page, status, links + hares)
+            self._urls.extend(links)
+            hares_links.extend(hares)
         self._urls.extend(await self._transform_hares(hares_links))
 
 
+    async def _search_pages(self, handle):
+        """
+        Handle all search pages to crawl at the same time.
+        In auto pagination mode, the pages are handled in windows of
+        '_auto_pages' pages instead, until a page comes back without any
+        links, so the requests match the real number of the search results.
+        '_end' still limits the pages if it's given. The search also stops
+        after a window in which no page is loaded, e.g. when the network is
+        down, since the end could never be found.
+
+        :param handle: a coroutine function taking a page index, and
+                       returning the number of links on the page, None if
+                       the page is not loaded
+        """
+        if not self._auto_pages:
+            await asyncio.gather(*[handle(page) for page in self._pages()])
+            return
+        page = self._start
+        while self._end is None or page <= self._end:
+            last = page + self._auto_pages - 1
+            if self._end is not None:
+                last = min(last, self._end)
+            window = [p for p in range(page, last+1) if self._state is None or not self._state.page_done(p)]
+            counts = await asyncio.gather(*[handle(p) for p in window])
+            empty = [p for p, n in zip(window, counts) if n == 0]
+            if empty:
+                print('The search results of ' + self._keyword + ' end at page ' + str(min(empty) - 1))
+                return
+            if window and all(n is None for n in counts):
+                logger.warning('Stopped searching {} at page {}, since none of the pages {}-{} is loaded'.format(
+                               self._keyword, page - 1, window[0], window[-1]))
+                return
+            page = last + 1
+
+
+    def _link_count(self, status, links):
+        """
+        :returns: the number of links on a search page, None if it's not
+                  loaded, so an error page never looks like the end
+        """
+        return len(links) if _loaded(status) else None
+
+
+    async def _fetch_search(self, limiter, page):
+        """
+        Fetch a search result page, and retry it after a backoff up to
+        '_recon' times while the server answers with an error, e.g. 429 or
+        503.
+
+        :returns: a tuple of (the undecoded response body, status)
+        """
+        url = self._searchURL + str(page)
+        for attempt in range(self._recon + 1):
+            if attempt > 0:
+                await asyncio.sleep(self._backoff(attempt))
+                logger.info('Retrying ({}/{}): {}'.format(attempt, self._recon, url))
+                self._metrics.inc('retries')
+            _, source_code, status = await self._bound_fetch(limiter, url, raw='bytes')
+            if _loaded(status):
+                break
+        else:
+            logger.warning('Failed to load the search page ({}): {}'.format(status, url))
+        return source_code, status
+
+
+    def _pages(self):
+        """
+        :returns: a list of the search pages to crawl, the pages finished by
+                  the resumed run are skipped
+        """
+        pages = range(self._start, self._end+1)
+        if self._state is None:
+            return list(pages)
+        return [page for page in pages if not self._state.page_done(page)]
+
+
+    def _resumed_links(self):
+        """
+        :returns: a list of the articles' links found by the resumed run
+        """
+        if self._state is None or not self._state.resumed:
+            return []
+        return self._state.links()
+
+
+    def _record_page(self, page, status, links):
+        """
+        Record a search page in the state only if it's loaded, so a page
+        answered with an error, e.g. 429 or 503, is crawled again when the
+        run is resumed.
+        """
+        if self._state is not None and _loaded(status):
+            self._state.add_page(page, links)
+
+
+    def _unseen(self, url):
+        """
+        :returns: True if the article hasn't been crawled by the resumed run,
+                  or by any run in incremental mode
+        """
+        return self._state is None or not self._state.seen(url, self._incremental)
+
+
+    async def _produce(self, queue, limiter, page):
+        """
+        Fetch a search result page and put its articles' links into the queue.
+        It waits if the queue is full, so the search pages won't run too far
+        ahead of the article fetching.
+        """
+        source_code, status = await self._fetch_search(limiter, page)
+        links, hares_links = self._search_links(source_code)
+        self._record_page(page, status, links + hares_links)
+        for l in links + hares_links:
+            await queue.put(l)
+        return self._link_count(status, links + hares_links)
+
+
+    async def _produce_links(self, queue, links):
+        for l in links:
+            await queue.put(l)
+
+
+    async def _consume(self, queue, limiter, proxies):
+        """
+        Take the articles' links from the queue and fetch the contents.
+        The Hares links are transformed into the real article URLs first.
+        """
+        while True:
+            url = await queue.get()
+            self._metrics.set('queue_depth', queue.qsize())
+            try:
+                if 'hare48.pixnet.net' in url:
+                    url = await self._resolve_hares(limiter, url)
+                self._urls.append(url)
+                if not self._unseen(url):
+                    continue
+                await self._fetch_article(limiter, url, proxies)
+            finally:
+                queue.task_done()
+
+
+    async def _crawl_pipeline(self, proxies):
+        """
+        Crawl the search result pages and the articles at the same time.
+        The articles' links found on a search page start downloading while
+        the other search pages are still loading. The links are passed
+        through a bounded queue to keep the memory usage predictable.
+        An error in a consumer stops the crawling and is raised, like it is
+        without the pipeline, instead of leaving the queue unfinished.
+
+        :param proxies: the proxies' urls for fetching the articles
+        """
+        self._urls = []
+        queue = asyncio.Queue(self._queue_size)
+        limiter = self._get_limiter()
+        consumers = [asyncio.ensure_future(self._consume(queue, limiter, proxies))
+                     for i in range(self._concurrency)]
+        producers = [asyncio.ensure_future(self._search_pages(lambda page: self._produce(queue, limiter, page)))]
+        producers.append(asyncio.ensure_future(self._produce_links(queue, self._resumed_links())))
+
+        async def produce():
+            await asyncio.gather(*producers)
+            await queue.join()
+        work = asyncio.ensure_future(produce())
+        tasks = [work] + producers + consumers
+        try:
+            done, _ = await asyncio.wait([work] + consumers, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()   # a consumer only ends with an error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
     async def get_contents(self):
         """
         Get the contents of all articles from the search results.
-        It will repeat for _recon + 1 times. Thus, if _recon is 0, it will
-        terminate after the initial connection is finished.
-        The result will be stored in the '_result' variable.
+        A failed article is retried right away with an exponential backoff,
+        through a different proxy each time, for at most _recon times. Thus,
+        if _recon is 0, each article is only requested once.
+        The normalized articles will be stored in the '_result' list, or
+        written to the output file article by article in streaming mode.
+        In pipeline mode, the search result pages are also crawled here, so
+        'get_article_links' is not needed.
+        """
+        urls = self._urls
+        proxy_list = await self._get_proxy_list()
+        self._start_executor()
+        try:
+            await self._get_contents(urls, proxy_list)
+        finally:
+            self._stop_executor()
+
+
+    async def _get_proxy_list(self):
+        """
+        :returns: a list of the proxies' urls, one for each attempt of an article
         """
         if self._recon < 0:
             raise ValueError('Reconnection time needs to be positive!')
-        urls = self._urls
+        self._get_sessions()      # share the sessions with the proxy pool
         proxy_list = await self._pool.get_proxies(self._recon + 1)
-        
-        for count in range(self._recon + 1):
-            proxy = proxy_list[count]
-            if count > 0:     # perform reconnection
-                if not self._re_urls:
-                    print('No need to reconnect.')
+        proxy_list += [None] * (self._recon + 1 - len(proxy_list))    # use the local IP address if proxies are not enough
+        if self._proxy_revalidate:
+            self._pool.start_revalidation(self._proxy_revalidate)
+        return proxy_list
+
+
+    def _start_executor(self):
+        if self._parser == 'pool':
+            self._executor = ProcessPoolExecutor(self._workers, initializer=_init_worker)
+
+
+    def _stop_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+    async def _get_contents(self, urls, proxy_list):
+        self._re_urls.clear()      # empty the failed urls list
+        if self._pipeline:
+            await self._crawl_pipeline(proxy_list)
+        else:
+            urls = [url for url in urls if self._unseen(url)]
+            limiter = self._get_limiter()
+            await asyncio.gather(*[self._fetch_article(limiter, url, proxy_list) for url in urls])
+        fail_num = len(self._re_urls)
+        self._metrics.inc('failed_articles', value=fail_num)
+        print('Failed to crawl ' + str(fail_num) + (' website.' if fail_num==1 else ' websites.'))
+        if self._state is not None:
+            self._state.failed(self._re_urls)
+
+
+    async def _fetch_article(self, limiter, url, proxies):
+        """
+        Fetch an article, or wait for its text in batch mode if another
+        keyword has found it already, so each article is only fetched once.
+
+        :param proxies: the proxies' urls, one for each attempt
+        """
+        if self._sink is None:
+            return await self._fetch_shared(limiter, url, proxies)
+        await self._room()
+        self._sink_fetching += 1
+        try:
+            return await self._fetch_shared(limiter, url, proxies)
+        finally:
+            self._sink_fetching -= 1
+            self._sink_room.set()
+
+
+    async def _fetch_shared(self, limiter, url, proxies):
+        if self._shared is None:
+            return await self._fetch_attempts(limiter, url, proxies)
+        future = self._shared.get(url)
+        if future is not None:
+            result = await asyncio.shield(future)     # (status, text, record)
+            if result is None:
+                self._re_urls.append(url)
+            else:
+                self._record(url, *result)
+            return
+        future = self._shared[url] = asyncio.get_event_loop().create_future()
+        try:
+            await self._fetch_attempts(limiter, url, proxies)
+        finally:
+            if not future.done():     # failed, '_record' sets the result otherwise
+                future.set_result(None)
+
+
+    async def _room(self):
+        """
+        Wait until the consumer of 'iter_articles' has taken enough records,
+        so the fetching slows down to the pace of the consumer. The articles
+        being fetched count, since each of them may become a record.
+        """
+        while self._sink.qsize() + self._sink_fetching >= self._sink_size:
+            self._sink_room.clear()
+            await self._sink_room.wait()
+
+
+    async def iter_articles(self, keyword=None, start=1, end=10, buffer=100):
+        """
+        Crawl a keyword and yield the articles as soon as they are parsed.
+        Nothing is written to the output file and nothing is asked, so the
+        crawler can be embedded in another asyncio program:
+
+            async with contextlib.aclosing(crawler.iter_articles('Deep Learning')) as articles:
+                async for article in articles:
+                    print(article['title'])
+
+        'aclosing' closes the sessions right away if the loop stops early,
+        instead of leaving it to the garbage collector.
+        At most 'buffer' articles wait for the consumer. When there're more,
+        no new article is fetched until the consumer catches up. The other
+        options, e.g. the proxies, the pipeline mode, the parser, the state
+        and the records file, are taken from the crawler. An article only
+        counts as crawled in the state when the consumer has taken it, so
+        the ones left in the buffer are crawled again by the next run.
+
+        :param keyword: the keyword to search, the crawler's keyword if None
+        :param end: the ending page index, None to find it by auto pagination
+        :param buffer: the maximum number of articles waiting for the consumer
+        :yields: dictionaries, the same records as the ones of '--records'
+        """
+        if keyword is not None:
+            self._keyword = keyword
+        self._start = start
+        self._end = end
+        if end is None and not self._auto_pages:
+            self._auto_pages = 5
+        self._sink = asyncio.Queue()
+        self._sink_size = buffer
+        self._sink_fetching = 0
+        self._sink_room = asyncio.Event()
+        finished = object()
+
+        async def crawl():
+            try:
+                if not self._pipeline:
+                    await self.get_article_links()
+                await self.get_contents()
+            finally:
+                self._sink.put_nowait(finished)
+
+        self._begin()
+        await self._serve_metrics()
+        self.open_records()
+        task = asyncio.ensure_future(crawl())
+        try:
+            while True:
+                item = await self._sink.get()
+                self._sink_room.set()
+                if item is finished:
                     break
-                else:
-                    if count == 1:
-                        print('Reconnecting...')
-                    print('\n----------------------------------------------------------')
-                    print(ordinal[count].capitalize() + ' reconnection...\n')
-                    urls = self._re_urls
+                url, status, text, record = item
+                if self._records is not None:
+                    self._records.write(record)
+                self._mark_done(url, status, text)
+                yield record
+            await task      # raise the error of the crawling if any
+            if self._state is not None:
+                self._state.finish_run()
+        finally:
+            if not task.done():     # the consumer stopped early
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            self._sink = None
+            self.close_records()
+            if self._state is not None:
+                self._state.commit()
+            await self.close()
+
+
+    async def _fetch_attempts(self, limiter, url, proxies):
+        """
+        Fetch an article and retry it until it succeeds or runs out of the
+        attempts. Each attempt goes through the healthiest proxy in the list
+        that hasn't been tried, after a backoff, so a failed article doesn't
+        wait for the others.
+        The URL is added to '_re_urls' if all attempts fail.
+
+        :param proxies: the proxies' urls, one for each attempt
+        """
+        tried = []
+        begin = time.monotonic()
+        for attempt in range(len(proxies)):
+            proxy = self._pool.select(proxies, tried)
+            tried.append(proxy)
+            if attempt > 0:
+                await asyncio.sleep(self._backoff(attempt))
+                logger.info('Retrying ({}/{}): {}'.format(attempt, len(proxies) - 1, url))
+                self._metrics.inc('retries')
+            started = time.monotonic()
+            result = await self._fetch(url, proxy, 'bytes', True, limiter)     # the extractors decode it
+            _, source_code, status, site = result
+            if not self._error(url, source_code, status, site, attempt == len(proxies) - 1):
+                timing = {'attempts': attempt + 1, 'fetch_time': round(time.monotonic() - started, 3),
+                          'elapsed': round(time.monotonic() - begin, 3), 'fetched_at': time.time()}
+                result = self._collect(result, timing)
+                if asyncio.iscoroutine(result):
+                    await result
+                return
+            if site < 0:     # unexpected website, no need to retry
+                return
+
+
+    def _backoff(self, attempt):
+        """
+        The exponential backoff with jitter before an attempt.
+
+        :returns: the seconds to wait
+        """
+        delay = min(self._max_backoff, self._base_backoff * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+    def _collect(self, result, timing=None):
+        """
+        Handle the response of an article as soon as it arrives.
+        If the process pool exists, the parsing is handed to it and a
+        coroutine is returned.
+
+        :param result: a tuple of (url, source_code, status, site)
+        :param timing: a dictionary of the fetch timing for the record
+        """
+        url, source_code, status, site = result
+        parts = self._wants_records()
+        if self._executor is None:
+            begin = time.monotonic()
+            parsed = self._get_plain_text(url, source_code, site, parts)
+            self._metrics.observe('parse_seconds', time.monotonic() - begin, (('parser', 'inline'),))
+            self._record(url, status, *self._make_record(url, status, site, timing, parsed))
+        else:
+            return self._collect_pooled(url, source_code, status, site, timing, parts)
 
-            result_list = await self._connect(urls, proxy=proxy, which_site=True)
 
-            self._re_urls.clear()      # empty the reconnect urls list 
-            for result in result_list:
-                url, soup, status, site = result
-                if not self._error(url, soup, status, site, True):
-                    self._result += self._get_plain_text(url, soup, site)
-            fail_num = len(self._re_urls)
-            if count == self._recon:
-                print('Failed to crawl ' + str(fail_num) + (' website.' if fail_num==1 else ' websites.'))
+    async def _collect_pooled(self, url, body, status, site, timing=None, parts=False):
+        """
+        Parse an article in the process pool, so the event loop keeps
+        serving the network while the CPU heavy parsing is running.
+        """
+        loop = asyncio.get_event_loop()
+        begin = time.monotonic()
+        parsed = await loop.run_in_executor(self._executor, _parse_article, url, body, site, parts)
+        self._metrics.observe('parse_seconds', time.monotonic() - begin, (('parser', 'pool'),))   # with the waiting
+        self._record(url, status, *self._make_record(url, status, site, timing, parsed))
 
-        self._result = re.sub(r'\s+', '', self._result)   # trim whitespaces
-        self._result = self._rm_duplicate(self._result)
 
+    def _make_record(self, url, status, site, timing, parsed):
+        """
+        Build the structured record of an article if the records are written.
 
-    def _get_plain_text(self, url, soup, site):
+        :param parsed: the result of '_get_plain_text'
+        :returns: a tuple of (text, record), the record is None if it's not needed
+        """
+        if not self._wants_records():
+            return parsed, None
+        text, parts = parsed
+        if parts is None:
+            return text, None
+        record = {'keyword': self._keyword, 'url': url, 'site': self._site_names[site],
+                  'title': parts[0], 'content': parts[1], 'status': status}
+        record.update(timing or {})
+        return text, record
+
+
+    def _wants_records(self):
+        return self._records is not None or self._sink is not None
+
+
+    def _record(self, url, status, text, record=None):
+        """
+        Emit the text of an article and mark it as done in the state.
+        In streaming mode, the state is committed every 100 articles after
+        the output file is flushed, so the articles marked as done are
+        always on the disk.
+        In batch mode, the text is also passed to the other keywords waiting
+        for the same article. Under 'iter_articles', the record is queued for
+        the consumer instead of the output, and it's only written to the
+        records file and marked as done when the consumer takes it.
+        A near-duplicate of an earlier article is dropped, but still marked
+        as done, so it won't be fetched again.
+        """
+        if self._shared is not None:
+            future = self._shared.get(url)
+            if future is not None and not future.done():
+                future.set_result((status, text, record))
+        if self._is_duplicate(url, text):
+            record = None
+        elif self._sink is None:
+            self._emit(text)
+        if record is not None:
+            record = dict(record, keyword=self._keyword)    # it may come from another keyword
+            if self._sink is not None:
+                self._sink.put_nowait((url, status, text, record))
+                return
+            if self._records is not None:
+                self._records.write(record)
+        self._mark_done(url, status, text)
+
+
+    def _mark_done(self, url, status, text):
+        if self._state is None:
+            return
+        self._state.done(url, status, text)
+        self._done_num += 1
+        if self._stream and self._done_num % 100 == 0:
+            self._checkpoint()
+
+
+    def _is_duplicate(self, url, text):
+        if self._dedup is None or not self._dedup.is_duplicate(text):
+            return False
+        logger.debug('Near-duplicate: %s', url)
+        self._metrics.inc('duplicates')
+        return True
+
+
+    def _checkpoint(self):
+        """
+        Flush the output files and commit the state.
+        The crawlers of a batch share the state database, so all of their
+        output files are flushed before the commit.
+        """
+        for crawler in self._batch or [self]:
+            if crawler._writer is not None:
+                crawler._writer.flush()
+        if self._records is not None:
+            self._records.flush()
+        self._state.commit()
+
+
+    def _emit(self, text):
+        """
+        Deliver the normalized text of an article.
+        In streaming mode, the text is appended to the output file right away.
+        Otherwise, it's added to '_result'.
+
+        :param text: the normalized text of an article
+        """
+        if self._tail == '，' and text.startswith('，'):   # the punctuation run continues
+            text = text[1:]                                 # from the previous article
+        if not text:
+            return
+        if self._stream:
+            self._writer.write(text)
+        else:
+            self._result.append(text)
+        self._tail = text[-1]
+
+
+    def _get_plain_text(self, url, source_code, site, parts=False):
         """
         Get the text in titles and articles.
-        
-        :returns: a string
+        Only the title and the content are parsed by the extractor of the
+        website, instead of the whole page.
+
+        :param source_code: the source code, or the undecoded response body
+        :param parts: True to get the normalized title and content as well
+        :returns: a string, or a tuple of (string, (title, content)) if 'parts'
+                  is True, the parts are None if they're not found
         """
-        print('Get plaint text: ' + url)
-        title = str(soup.find(class_=self._title_tags[site]))
-        content = str(soup.find(class_=self._content_tags[site]))
+        logger.debug('Get plaint text: ' + url)
+        title, content = self._extractors[site].extract(source_code)
         # h = html2text.HTML2Text()    # uncomment this segment of code
         # h.ignore_links = True        # if you want to get plain text
         # h.ignore_images = True
         # title = h.handle(title)
         # content = h.handle(content)
         if title == None or content == None:
-            print('Different website structure: ' + url)
-            return ''
-        return self._clean(title + content, no_punc=True)    # with symbols
-        # return title + content               # without symbols
+            logger.warning('Different website structure: ' + url)
+            return ('', None) if parts else ''
+        if parts:
+            return self._normalize(title + content), (self._normalize(title), self._normalize(content))
+        return self._normalize(title + content)    # with symbols
+        # return title + content                   # without symbols
 
 
-    def _clean(self, texts, no_punc=False):
+    def _normalize(self, text):
         """
-        Clean the symbols in a string.
-        If no_punc is True, no symbols will remain in the text.
-        Otherwise, only the symbols specified in '_punc' will be reserved.
+        Normalize a text in a single pass.
+        The stop words and whitespaces are removed and the symbols specified
+        in '_punc' are replaced with '，' through a translation table. Two
+        symbols or more that are adjacent (even with whitespaces in between)
+        will be considered as one symbol.
 
-        :param texts: a string with symbols
-        :param no_punc: a boolean value to determine the removal of punctuation marks
+        :param text: a string with symbols
         :returns: a string
         """
-        result = ''
-        sw = self._sw_no_punc_dict if no_punc else self._sw_dict
-        for t in texts:
-            if t not in sw:
-                result += t
-        return result
+        return self._norm_re.sub('，', text.translate(self._norm_table))
 
 
-    def _rm_duplicate(self, s):
+    def open_output(self):
         """
-        Replace the symbols specified in '_punc' with '，'.
-        Two symbols or more that are adjacent will be consider
-        as one symbol.
+        Open the output file for streaming mode.
+        Articles are appended through a buffered writer, so whatever has been
+        crawled is on the disk once the file is closed, even if the crawling
+        is interrupted.
+        """
+        self._writer = open(self._filename, 'a' if self._append else 'w', encoding='UTF-8', buffering=1 << 16)
+        self._tail = ''
 
-        :param s: a string with punctuation marks
-        :returns: a string
+
+    def close_output(self):
         """
-        punc_re = '([{}]+)'.format(self._punc)
-        result = re.sub(punc_re, r'，', s)
-        return result
+        Write the articles crawled so far, then commit the state, so an
+        article marked as done is always in the output file, even if the
+        crawling is interrupted.
+        """
+        self._write_output()
+        self.close_records()
+        if self._state is not None:
+            self._state.commit()
+
+
+    def open_records(self, append=None):
+        """
+        Open the records file, which gets a JSON record for each article.
+
+        :param append: True to append to the file, the same as the output
+                       file if None
+        """
+        if self._records_file:
+            self._records = RecordWriter.RecordWriter(self._records_file, self._append if append is None else append)
+
+
+    def close_records(self):
+        if self._records is not None:
+            self._records.close()
+            print('Wrote {} records to \"{}\"'.format(self._records.count, self._records_file))
+            self._records = None
+
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
 
 
     def output(self):
-        with open(self._filename, 'w', encoding='UTF-8') as f:
-            f.write(self._result)
+        self.close_output()
+        self._show_output()
+
+
+    def _write_output(self):
+        if self._stream:
+            self._close_writer()
+        else:
+            with open(self._filename, 'a' if self._append else 'w', encoding='UTF-8') as f:
+                f.writelines(self._result)
+
+
+    def _show_output(self):
         print('\n----------------------------------------------------------')
         print('Successfully writed output file: \"{}\"'.format(self._filename))
 
 
-    async def crawl(self):
+    def _begin(self):
+        """
+        Get ready for crawling the keyword, and resume the unfinished run of
+        it if the state is used.
+        """
         self.set_searchURL()
+        self._use_dedup()
         print('Start crawling for ' + self._keyword + '...')
+        if self._state is not None:
+            resumed = self._state.start_run(self._keyword)
+            if resumed:
+                print('Resuming the unfinished crawling of ' + self._keyword + '...')
+            self._append = resumed or self._incremental    # the earlier articles are in the output file already
+
+
+    def _use_dedup(self):
+        if self._dedup_distance is not None:
+            self._dedup = NearDuplicates.NearDuplicates(self._dedup_distance)
+
+
+    async def _serve_metrics(self):
+        if self._metrics_port is not None:
+            await self._metrics.serve(self._metrics_port)
+            print('Serving the metrics at http://localhost:{}/metrics'.format(self._metrics_port))
+
+
+    async def crawl(self):
+        self._begin()
+        await self._serve_metrics()
         start = time.time()
-        await self.get_article_links()
-        link = time.time()
-        await self.get_contents()
+        try:
+            if not self._pipeline:
+                await self.get_article_links()
+            link = time.time()
+            if self._stream:
+                self.open_output()
+            self.open_records()
+            try:
+                await self.get_contents()
+            except BaseException:
+                self.close_output()     # keep the articles crawled so far
+                raise
+        finally:
+            await self.close()
         content = time.time()
         self.output()
+        if self._state is not None:
+            self._state.finish_run()
         output = time.time()
         print('\n----------------------------------------------------------')
         print('Time measurement:')
-        print('Get all articles\' links: ' + str(round(link - start, 2)) + ' sec')
+        if self._pipeline:
+            print('Get all articles\' links and contents: ' + str(round(content - link, 2)) + ' sec')
+        else:
+            print('Get all articles\' links: ' + str(round(link - start, 2)) + ' sec')
+            print('Get all articles\' contents: ' + str(round(content - link, 2)) + ' sec')
+        print('Writing output file: ' + str(round(output - content, 2)) + ' sec')
+        print('Total: ' + str(round(output - start, 2)) + ' sec')
+        self._report()
+
+
+    def load_batch(self, filename):
+        """
+        Load the keywords for batch mode.
+        A '.jsonl' file has a JSON object on each line, with the 'keyword'
+        and optionally the 'start', 'end' and 'output' of it. Otherwise,
+        each line of the file is a keyword, and the empty lines and the lines
+        starting with '#' are ignored.
+        A keyword given more than once is only crawled once.
+
+        :param filename: the keyword file
+        """
+        jobs = {}
+        with open(filename, 'r', encoding='UTF-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                job = json.loads(line) if filename.endswith('.jsonl') else {'keyword': line}
+                if isinstance(job, str):
+                    job = {'keyword': job}
+                if not job.get('keyword'):
+                    raise ValueError('No keyword in the line: ' + line)
+                jobs.setdefault(job['keyword'], job)
+        self._jobs = list(jobs.values())
+
+
+    def _child(self, job):
+        """
+        Create the crawler of a keyword in batch mode.
+        It shares the sessions, the proxy pool, the limiter, the cache, the
+        process pool and the fetched articles with this crawler, but has its
+        own links, results, output file and run in the state.
+
+        :param job: a dictionary loaded by 'load_batch'
+        """
+        crawler = copy.copy(self)
+        crawler._keyword = job['keyword']
+        crawler._start = job.get('start', self._start)
+        crawler._end = job.get('end', self._end)
+        crawler._filename = os.path.join(self._output_dir, job.get('output', job['keyword'] + '.txt'))
+        crawler._urls = []
+        crawler._re_urls = []
+        crawler._result = []
+        crawler._writer = None
+        crawler._tail = ''
+        crawler._done_num = 0
+        if self._state is not None:
+            crawler._state = self._state.fork()
+        return crawler
+
+
+    async def crawl_batch(self):
+        """
+        Crawl all keywords loaded by 'load_batch' at the same time.
+        The keywords share one set of sessions, proxies and concurrency
+        limits, and an article found by several keywords is only fetched
+        once, then written to the output file of each of them.
+        The output files and the state are finished after all keywords are
+        crawled, so the state never records an article that's not written.
+        """
+        self._get_sessions()
+        self._get_limiter()
+        self._shared = {}
+        self._batch = []
+        await self._serve_metrics()
+        start = time.time()
+        try:
+            self._start_executor()
+            self._batch.extend(self._child(job) for job in self._jobs)
+            for crawler in self._batch:
+                crawler._begin()
+            self.open_records(any(crawler._append for crawler in self._batch))
+            for crawler in self._batch:     # the records file is shared by the keywords
+                crawler._records = self._records
+            if not self._pipeline:
+                await asyncio.gather(*[crawler.get_article_links() for crawler in self._batch])
+            link = time.time()
+            if self._stream:
+                for crawler in self._batch:
+                    crawler.open_output()
+            try:
+                proxy_list = await self._get_proxy_list()
+                await asyncio.gather(*[crawler._get_contents(crawler._urls, proxy_list) for crawler in self._batch])
+            except BaseException:
+                for crawler in self._batch:     # keep the articles crawled so far
+                    crawler._write_output()
+                self.close_records()
+                if self._state is not None:
+                    self._state.commit()
+                raise
+        finally:
+            self._stop_executor()
+            await self.close()
+        content = time.time()
+        for crawler in self._batch:
+            crawler._write_output()
+        self.close_records()
+        if self._state is not None:
+            self._state.commit()
+        for crawler in self._batch:
+            crawler._show_output()
+            if crawler._state is not None:
+                crawler._state.finish_run()
+        output = time.time()
+        print('\n----------------------------------------------------------')
+        print('Batch: {} keywords, {} articles\' links, {} articles fetched'.format(
+              len(self._batch), sum(len(crawler._urls) for crawler in self._batch), len(self._shared)))
+        print('Time measurement:')
+        if not self._pipeline:
+            print('Get all articles\' links: ' + str(round(link - start, 2)) + ' sec')
         print('Get all articles\' contents: ' + str(round(content - link, 2)) + ' sec')
+        print('Writing output files: ' + str(round(output - content, 2)) + ' sec')
+        print('Total: ' + str(round(output - start, 2)) + ' sec')
+        self._report()
+
+
+    async def crawl_sharded(self):
+        """
+        Coordinate a sharded crawling.
+        The search pages are put into the work queue, and '_shards' worker
+        processes are started to crawl them and the articles found on them.
+        More workers can join from other machines with the '--worker' option.
+        A local worker that dies is started again, and its leased tasks are
+        taken over by the other workers when the leases expire.
+        The texts are merged into the output file after the queue is finished.
+        """
+        queue = WorkQueue.WorkQueue(self._queue_file)
+        queue.setup(self._keyword, range(self._start, self._end+1))
+        print('Start crawling for ' + self._keyword + ' with ' + str(self._shards) + ' workers...')
+        settings = {name: getattr(self, name) for name in _worker_settings}
+        context = multiprocessing.get_context('spawn')      # the event loop is not forked
+        processes = []
+        start = time.time()
+        try:
+            while not queue.finished():
+                processes = [p for p in processes if p.exitcode is None]
+                for i in range(self._shards - len(processes)):
+                    p = context.Process(target=_run_worker, args=(self._queue_file, settings, self._pool.selection,
+                                                                  logger.getEffectiveLevel()))
+                    p.start()
+                    processes.append(p)
+                await asyncio.sleep(1)
+        finally:
+            for p in processes:
+                p.join(self._lease_time)
+                if p.exitcode is None:
+                    p.terminate()
+        content = time.time()
+        self._use_dedup()       # the workers keep all texts, the near-duplicates are dropped here
+        if self._stream:
+            self.open_output()
+        for text in queue.texts():
+            if self._dedup is None or not self._dedup.is_duplicate(text):
+                self._emit(text)
+        self.output()
+        if self._dedup is not None:
+            self._dedup.report()
+        counts = queue.counts()
+        queue.close()
+        output = time.time()
+        print('Pages: {} done, {} failed. Articles: {} done, {} failed.'.format(
+              counts.get(('page', 'done'), 0), counts.get(('page', 'failed'), 0),
+              counts.get(('article', 'done'), 0), counts.get(('article', 'failed'), 0)))
+        print('\n----------------------------------------------------------')
+        print('Time measurement:')
+        print('Get all articles\' links and contents: ' + str(round(content - start, 2)) + ' sec')
         print('Writing output file: ' + str(round(output - content, 2)) + ' sec')
         print('Total: ' + str(round(output - start, 2)) + ' sec')
 
 
+    async def work(self):
+        """
+        Work on the tasks of a sharded crawling until the queue is finished.
+        Up to '_lease_size' tasks are leased and crawled at the same time, and
+        more are leased as soon as some of them are finished. The leases are
+        renewed in the background while the worker is alive.
+        """
+        queue = WorkQueue.WorkQueue(self._queue_file)
+        self._keyword = queue.keyword
+        if self._keyword is None:
+            raise ValueError('The queue "{}" has no keyword.'.format(self._queue_file))
+        self.set_searchURL()
+        worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+        print('Worker ' + worker + ' started for ' + self._keyword)
+        self._shared = {}
+        limiter = self._get_limiter()
+        renewer = asyncio.ensure_future(self._renew(queue, worker))
+        running = set()
+        try:
+            proxy_list = await self._get_proxy_list()
+            self._start_executor()
+            while True:
+                for task in queue.lease(worker, self._lease_size - len(running), self._lease_time):
+                    running.add(asyncio.ensure_future(self._work_on(queue, limiter, task, proxy_list)))
+                if not running:
+                    if queue.finished():
+                        break
+                    await asyncio.sleep(1)      # the other workers may still find articles
+                    continue
+                done, running = await asyncio.wait(running, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()
+        finally:
+            for task in running:
+                task.cancel()
+            renewer.cancel()
+            await asyncio.gather(renewer, *running, return_exceptions=True)
+            self._stop_executor()
+            await self.close()
+            queue.close()
+
+
+    async def _renew(self, queue, worker):
+        while True:
+            await asyncio.sleep(self._lease_time / 3)
+            queue.renew(worker, self._lease_time)
+
+
+    async def _work_on(self, queue, limiter, task, proxies):
+        """
+        Crawl a task leased from the work queue.
+
+        :param task: a tuple of (id, kind, payload), the payload is the page
+                     index of a search page, or the URL of an article
+        """
+        task_id, kind, payload = task
+        if kind == 'page':
+            source_code, status = await self._fetch_search(limiter, payload)
+            if not _loaded(status):     # e.g. 429 or 503, it may load in a later lease
+                queue.release(task_id)
+                return
+            links, hares_links = self._search_links(source_code)
+            queue.complete_page(task_id, links + await self._transform_hares(hares_links))
+        else:
+            await self._fetch_article(limiter, payload, proxies)
+            self._result.clear()    # the text goes to the queue instead
+            result = self._shared.pop(payload).result()
+            if result is None:
+                queue.complete_article(task_id, None, None)
+            else:
+                queue.complete_article(task_id, result[0], result[1])
+
+
+    def _report(self):
+        self._metrics.report()
+        self._hares_cache.report()
+        for crawler in self._batch or [self]:
+            if crawler._dedup is not None:
+                crawler._dedup.report()
+        if self._metrics_file:
+            self._metrics.save(self._metrics_file)
+            print('Saved the metrics to \"{}\"'.format(self._metrics_file))
+        if self._cache is not None:
+            self._cache.report()
+        if self._limiter is not None:
+            self._limiter.report()
+        if self._sessions is not None:
+            self._sessions.report()
+
+
     def process_command(self):
         parser = argparse.ArgumentParser(description='This is an asyncronous crawler for Pixnet\'s blog posts.')
         g1 = parser.add_argument_group('search options')
-        g1.add_argument('-k', '--keyword', type=str, required=True, help='Keywords to search on Pixnet\'s blog')
+        g1.add_argument('-k', '--keyword', type=str, help='Keywords to search on Pixnet\'s blog')
+        g1.add_argument('-b', '--batch', type=str, help='A file of keywords (one per line, or a .jsonl file) to crawl at the same time.')
         g1.add_argument('-s', '--start', type=int, default=1, help='The starting page index for crawling, default is 1.')
-        g1.add_argument('-e', '--end', type=int, default=10, help='The ending page index for crawling, default is 10.')
+        g1.add_argument('-e', '--end', type=int, help='The ending page index for crawling, default is 10, or no limit with --auto-pages.')
+        g1.add_argument('-a', '--auto-pages', type=int, nargs='?', const=5, default=0, help='Crawl the search pages AUTO_PAGES (default 5) at a time until a page has no results, instead of guessing the ending page.')
         g2 = parser.add_argument_group('time related options')
         g2.add_argument('-t', '--timeout', type=int, default=25, help='The acceptable time for the server\'s response.')
-        g2.add_argument('-r', '--recon', type=int, default=3, help='The reconnection times if reconnection is needed.')
-        g3 = parser.add_argument_group('output options')
-        g3.add_argument('-o', '--output', type=str, help='The name of the output file.')
-        return parser.parse_args()
+        g2.add_argument('-r', '--recon', type=int, default=3, help='The maximum retries of a failed article, each through a different proxy, or of a search page answered with an error.')
+        g2.add_argument('-n', '--concurrency', type=int, default=1000, help='The maximum number of connections at the same time, default is 1000.')
+        g2.add_argument('--rate', type=float, help='The maximum requests per second to each site (e.g. pixnet.net) through each proxy, no limit if it\'s not given.')
+        g2.add_argument('--limit-per-host', type=int, default=0, help='The maximum connections kept to a host through a proxy, default is 0 (no limit).')
+        g2.add_argument('--dns-ttl', type=int, default=300, help='The seconds to cache the DNS results, default is 300.')
+        g2.add_argument('--keepalive', type=int, default=30, help='The seconds to keep an idle connection for reuse, default is 30.')
+        g2.add_argument('--proxy-selection', type=str, choices=['least-latency', 'weighted'], default='least-latency', help='How the proxies are chosen, default is least-latency.')
+        g2.add_argument('--proxy-revalidate', type=int, default=0, help='Retest the proxies every PROXY_REVALIDATE seconds during the crawling, default is 0 (never).')
+        g2.add_argument('--proxy-snapshot', type=str, help='The file keeping the proxy pool between the runs.')
+        g2.add_argument('--proxy-ttl', type=int, default=1800, help='The seconds for a proxy in the snapshot to be used without testing, default is 1800.')
+        g2.add_argument('--shards', type=int, help='Split the crawling among SHARDS worker processes through a work queue.')
+        g2.add_argument('--worker', action='store_true', help='Only work on the tasks in the queue given by --queue, e.g. on another machine.')
+        g2.add_argument('--queue', type=str, help='The work queue file of a sharded crawling, default is "[keyword].queue".')
+        g2.add_argument('--lease-size', type=int, default=100, help='The maximum tasks a worker works on at the same time, default is 100.')
+        g2.add_argument('--lease-time', type=int, default=120, help='The seconds before the tasks of a dead worker are taken over, default is 120.')
+        g2.add_argument('-p', '--pipeline', action='store_true', help='Fetch the articles while the search pages are still loading.')
+        g2.add_argument('-q', '--queue-size', type=int, default=1000, help='The maximum number of links waiting to be fetched in pipeline mode, default is 1000.')
+        g3 = parser.add_argument_group('parsing options')
+        g3.add_argument('--parser', type=str, choices=['inline', 'pool'], default='inline', help='Parse the articles in the event loop (inline) or in a process pool (pool), default is inline.')
+        g3.add_argument('-w', '--workers', type=int, help='The number of processes for the pool parser, default is the number of CPUs.')
+        g4 = parser.add_argument_group('cache options')
+        g4.add_argument('-c', '--cache', type=str, help='The cache file of the responses. No cache is used if it\'s not given.')
+        g4.add_argument('--cache-ttl', type=int, default=86400, help='The seconds for a cached response to be used without revalidation, default is 86400.')
+        g4.add_argument('--hares-cache', type=str, help='The file keeping the real article URLs of the Hares links between the runs.')
+        g4.add_argument('--cache-size', type=int, default=512, help='The maximum size (MB) of the cache, default is 512.')
+        g5 = parser.add_argument_group('state options')
+        g5.add_argument('--state', type=str, help='The file recording the progress of the crawling. An interrupted crawling is resumed with the same file.')
+        g5.add_argument('--incremental', action='store_true', help='Only crawl the articles that are not crawled by the earlier runs. Requires --state.')
+        g6 = parser.add_argument_group('output options')
+        g6.add_argument('-o', '--output', type=str, help='The name of the output file, or the output directory in batch mode.')
+        g6.add_argument('--records', type=str, help='Also write a JSON record for each article to this file, compressed if it ends with .gz or .zst.')
+        g6.add_argument('--metrics', type=str, help='Save the metrics of the crawling to this JSON file.')
+        g6.add_argument('--metrics-port', type=int, help='Serve the metrics for Prometheus at http://localhost:METRICS_PORT/metrics during the crawling.')
+        g6.add_argument('--log-level', type=str, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO', help='DEBUG shows every URL, INFO (the default) shows the retries and the failed ones.')
+        g6.add_argument('--stream', action='store_true', help='Write each article to the output file as soon as it\'s crawled.')
+        g6.add_argument('--dedup', type=int, metavar='DISTANCE', help='Drop the near-duplicate articles whose SimHash fingerprints differ in at most DISTANCE of 64 bits, 3 is a good start.')
+        args = parser.parse_args()
+        if args.worker:
+            if not args.queue:
+                parser.error('--worker requires --queue')
+        elif bool(args.keyword) == bool(args.batch):
+            parser.error('one of -k/--keyword and -b/--batch is required')
+        if args.shards is not None and args.auto_pages:
+            parser.error('--auto-pages can\'t be used with --shards')
+        if (args.shards is not None or args.worker) and (args.batch or args.state or args.cache or args.pipeline or args.records
+                                                          or args.metrics or args.metrics_port is not None
+                                                          or args.hares_cache or args.proxy_snapshot):
+            parser.error('--shards and --worker can\'t be used with --batch, --state, --cache, --pipeline, --records, '
+                         '--metrics, --metrics-port, --hares-cache or --proxy-snapshot')
+        if args.incremental and not args.state:
+            parser.error('--incremental requires --state')
+        if args.dedup is not None and not 0 <= args.dedup < 16:
+            parser.error('--dedup needs to be between 0 and 15')
+        return args
 
     def show_options(self):
         print('\n----------------------------------------------------------')
         print('{:20}{}{}'.format('OPTIONS', '| ', 'VALUES'))
         print('----------------------------------------------------------')
-        print('{:20}{}{}'.format('keyword', '| ', self._keyword))
+        if self._jobs:
+            print('{:20}{}{}'.format('keywords', '| ', ', '.join(job['keyword'] for job in self._jobs)))
+        else:
+            print('{:20}{}{}'.format('keyword', '| ', self._keyword))
         print('{:20}{}{}'.format('start page', '| ', self._start))
-        print('{:20}{}{}'.format('end page', '| ', self._end))
+        print('{:20}{}{}'.format('end page', '| ', 'auto' if self._end is None else self._end))
+        if self._auto_pages:
+            print('{:20}{}{}'.format('page window', '| ', self._auto_pages))
         print('{:20}{}{}'.format('timeout', '| ', self._timeout))
         print('{:20}{}{}'.format('reconnection times', '| ', self._recon))
-        print('{:20}{}{}'.format('output filename', '| ', self._filename))
+        print('{:20}{}{}'.format('concurrency', '| ', self._concurrency))
+        print('{:20}{}{}'.format('rate limit', '| ', self._rate))
+        print('{:20}{}{}'.format('proxy selection', '| ', self._pool.selection))
+        if self._pool.snapshot is not None:
+            print('{:20}{}{}'.format('proxy snapshot', '| ', self._pool.snapshot))
+        if self._queue_file:
+            print('{:20}{}{}'.format('shards', '| ', self._shards))
+            print('{:20}{}{}'.format('work queue', '| ', self._queue_file))
+        print('{:20}{}{}'.format('pipeline', '| ', self._pipeline))
+        if self._pipeline:
+            print('{:20}{}{}'.format('queue size', '| ', self._queue_size))
+        print('{:20}{}{}'.format('parser', '| ', self._parser))
+        if self._parser == 'pool':
+            print('{:20}{}{}'.format('parsing workers', '| ', self._workers))
+        if self._cache is not None:
+            print('{:20}{}{}'.format('cache', '| ', self._cache.filename))
+        if self._hares_cache.filename:
+            print('{:20}{}{}'.format('hares cache', '| ', self._hares_cache.filename))
+        if self._state is not None:
+            print('{:20}{}{}'.format('state', '| ', self._state.filename))
+            print('{:20}{}{}'.format('incremental', '| ', self._incremental))
+        if self._jobs:
+            print('{:20}{}{}'.format('output directory', '| ', self._output_dir or '.'))
+        else:
+            print('{:20}{}{}'.format('output filename', '| ', self._filename))
+        print('{:20}{}{}'.format('streaming output', '| ', self._stream))
+        if self._dedup_distance is not None:
+            print('{:20}{}{}'.format('dedup distance', '| ', self._dedup_distance))
+        if self._records_file:
+            print('{:20}{}{}'.format('records', '| ', self._records_file))
+        if self._metrics_file:
+            print('{:20}{}{}'.format('metrics', '| ', self._metrics_file))
+        if self._metrics_port is not None:
+            print('{:20}{}{}'.format('metrics port', '| ', self._metrics_port))
         print('----------------------------------------------------------\n')
 
 
+class _NoSlot:
+    """
+    A placeholder of the limiter's slot when there's no limiter.
+    """
+
+    status = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+def _loaded(status):
+    """
+    :returns: True if a response with the status has the page's content
+    """
+    return 0 < status < 400
+
+
+def _phase(url):
+    """
+    :returns: the phase of the crawling that requests the URL
+    """
+    if 'searcharticle' in url:
+        return 'search'
+    if 'hare48.pixnet.net' in url:
+        return 'hares'
+    return 'article'
+
+
+_worker_settings = ('_timeout', '_recon', '_concurrency', '_rate', '_initial_limit', '_limit_per_host', '_dns_ttl',
+                    '_keepalive', '_proxy_revalidate', '_base_backoff', '_max_backoff', '_parser', '_workers',
+                    '_lease_size', '_lease_time')
+
+
+def _run_worker(queue_file, settings, selection, log_level=logging.INFO):
+    """
+    The entry of a worker process started by the coordinator.
+
+    :param settings: a dictionary of the coordinator's attributes in '_worker_settings'
+    """
+    logging.basicConfig(level=log_level, format='%(message)s')
+    pc = PixnetCrawler()
+    for name, value in settings.items():
+        setattr(pc, name, value)
+    pc.queue_file = queue_file
+    pc.set_proxy_selection(selection)
+    asyncio.run(pc.work())
+
+
+_worker_crawler = None
+
+
+def _init_worker():
+    """
+    Build a crawler in each worker process once for its translation table.
+    """
+    global _worker_crawler
+    _worker_crawler = PixnetCrawler()
+
+
+def _parse_article(url, body, site, parts=False):
+    """
+    Get the normalized text of an article in a worker process.
+
+    :param body: the undecoded response body
+    :returns: the result of '_get_plain_text'
+    """
+    return _worker_crawler._get_plain_text(url, body, site, parts)
+
+
 async def main():
     pc = PixnetCrawler()
     args = pc.process_command()
+    logging.basicConfig(level=args.log_level, format='%(message)s')
     if args.keyword:
         pc.keyword = args.keyword
     if args.start:
         pc.start = args.start
     if args.end:
         pc.end = args.end
+    elif args.auto_pages:
+        pc.end = None
+    else:
+        pc.end = 10
+    pc.auto_pages = args.auto_pages
     if args.timeout:
         pc.timeout = args.timeout
     if args.recon:
         pc.recon = args.recon
-    if args.output:
+    pc.lease_size = args.lease_size
+    pc.lease_time = args.lease_time
+    if args.shards is not None:
+        pc.shards = args.shards
+        pc.queue_file = args.queue or args.keyword + '.queue'
+    if args.batch:
+        pc.load_batch(args.batch)
+        pc.output_dir = args.output or ''
+    elif args.output:
         pc.filename = args.output
-    else:
+    elif args.keyword:
         pc.filename = args.keyword + '.txt'
+    pc.stream = args.stream
+    pc.dedup = args.dedup
+    if args.records:
+        pc.records_file = args.records
+    if args.metrics:
+        pc.metrics_file = args.metrics
+    pc.metrics_port = args.metrics_port
+    if args.concurrency:
+        pc.concurrency = args.concurrency
+    pc.rate = args.rate
+    pc.limit_per_host = args.limit_per_host
+    pc.dns_ttl = args.dns_ttl
+    pc.keepalive = args.keepalive
+    pc.set_proxy_selection(args.proxy_selection)
+    pc.proxy_revalidate = args.proxy_revalidate
+    if args.proxy_snapshot:
+        pc.use_proxy_snapshot(args.proxy_snapshot, args.proxy_ttl)
+    pc.parser = args.parser
+    if args.cache:
+        pc.use_cache(args.cache, args.cache_ttl, args.cache_size * 2**20)
+    if args.hares_cache:
+        pc.use_hares_cache(args.hares_cache)
+    if args.state:
+        pc.use_state(args.state)
+        pc.incremental = args.incremental
+    if args.workers:
+        pc.workers = args.workers
+    pc.pipeline = args.pipeline
+    if args.queue_size:
+        pc.queue_size = args.queue_size
+    if args.worker:     # unattended, the keyword comes from the queue
+        pc.queue_file = args.queue
+        await pc.work()
+        return
     pc.show_options()
+    if args.batch:      # unattended
+        await pc.crawl_batch()
+        return
     print('Press ENTER to continue. Otherwise, press \'!\' to exit.')
     while True:
         k = input()
         if k == '':
-            await pc.crawl()
+            if args.shards is not None:
+                await pc.crawl_sharded()
+            else:
+                await pc.crawl()
             return
         elif k == '!':
             sys.exit()
@@ -1,9 +1,75 @@
+import os
 import re
+import json
+import time
+import random
 import asyncio
 import aiohttp
-import requests
+import SessionManager
 from bs4 import BeautifulSoup
 
+
+class ProxyHealth:
+    """
+    The health of a proxy: its smoothed latency and success rate, and the
+    time it was last checked.
+    A proxy is benched for a while after a number of failures in a row, like
+    a circuit breaker. It's given another chance once the bench time is over,
+    and benched again right away if it fails once more.
+    """
+
+    def __init__(self):
+        self.tested = False
+        self.latency = None
+        self.success_rate = 1.0
+        self.failures = 0        # failures in a row
+        self.last_checked = 0.0
+        self.benched_until = 0.0
+
+
+    @property
+    def benched(self):
+        return time.time() < self.benched_until
+
+
+    @property
+    def score(self):
+        """
+        The expected seconds for a successful request, lower is better.
+        """
+        return (self.latency or 1.0) / max(self.success_rate, 0.01)
+
+
+    def to_dict(self):
+        return {'latency': self.latency, 'success_rate': self.success_rate, 'failures': self.failures,
+                'last_checked': self.last_checked, 'benched_until': self.benched_until}
+
+
+    @classmethod
+    def from_dict(cls, d):
+        health = cls()
+        health.tested = True
+        health.latency = d.get('latency')
+        health.success_rate = d.get('success_rate', 1.0)
+        health.failures = d.get('failures', 0)
+        health.last_checked = d.get('last_checked', 0.0)
+        health.benched_until = d.get('benched_until', 0.0)
+        return health
+
+
+    def record(self, ok, latency, max_failures=3, bench_time=60):
+        self.last_checked = time.time()
+        self.success_rate = 0.8 * self.success_rate + (0.2 if ok else 0.0)
+        if ok:
+            self.failures = 0
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            return
+        self.failures += 1
+        if self.failures >= max_failures:
+            self.benched_until = self.last_checked + bench_time
+            self.failures = max_failures - 1    # half open after the bench
+
+
 class ProxyPool:
 
     def __init__(self):
@@ -12,6 +78,17 @@ class ProxyPool:
         self._limits = [300, 200, 80, 100, 100, 100]
         self._ip_test = 'https://httpbin.org/ip'
         self._pool = {}
+        self._timeout = 5
+        self._concurrency = 50     # the proxies tested at the same time
+        self._sessions = None
+        self._selection = 'least-latency'
+        self._max_failures = 3
+        self._bench_time = 60
+        self._revalidator = None
+        self._snapshot = None
+        self._snapshot_ttl = 1800
+        self._recheck = []
+        self._checker = None
 
     @property
     def num(self):
@@ -23,87 +100,323 @@ class ProxyPool:
         return self._pool
 
 
-    def _fetch(self, site, start=1, end=10):
-        print('Fetching proxies...')
+    @property
+    def available(self):
+        return len(self._healthy())
+
+
+    @property
+    def sessions(self):
+        return self._sessions
+
+
+    @sessions.setter
+    def sessions(self, value):
+        self._sessions = value
+
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+
+    @property
+    def selection(self):
+        return self._selection
+
+
+    @selection.setter
+    def selection(self, value):
+        self._selection = value
+
+
+    def _get_sessions(self):
+        """
+        Use the sessions shared by the crawler, so the connections to a
+        proxy made during the test are reused by the crawling.
+        """
+        if self._sessions is None:
+            self._sessions = SessionManager.SessionManager(self._timeout)
+        return self._sessions
+
+
+    async def close(self):
+        await self.stop_revalidation()
+        self.save_snapshot()
+        if self._sessions is not None:
+            await self._sessions.close()
+
+
+    def use_snapshot(self, filename, ttl=1800):
+        """
+        Load the proxies and their health saved by the last run, so the
+        crawling can start without scraping and testing the proxies again.
+        The proxies checked within 'ttl' seconds are used right away, and
+        only get a quick test in the background. The older ones are kept as
+        untested ones. The pool is saved to the same file by 'save_snapshot'.
+
+        :param filename: the snapshot file
+        :param ttl: the seconds for a saved proxy to be trusted
+        """
+        self._snapshot = filename
+        self._snapshot_ttl = ttl
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename, 'r', encoding='UTF-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print('Unable to load the proxy snapshot: ' + str(e))
+            return
+        deadline = time.time() - ttl
+        for proxy, d in saved.items():
+            health = ProxyHealth.from_dict(d)
+            if health.last_checked < deadline:
+                health = ProxyHealth()      # too old to be trusted
+            else:
+                self._recheck.append(proxy)
+            self._pool.setdefault(proxy, health)
+        print('Loaded ' + str(len(self._recheck)) + ' recent proxies from ' + filename)
+
+
+    def save_snapshot(self):
+        if self._snapshot is None:
+            return
+        saved = {p: health.to_dict() for p, health in self._pool.items() if health.tested}
+        temp = self._snapshot + '.tmp'
+        with open(temp, 'w', encoding='UTF-8') as f:
+            json.dump(saved, f)
+        os.replace(temp, self._snapshot)     # never leave a broken snapshot
+
+
+    def _check_snapshot(self):
+        """
+        Quickly retest the proxies loaded from the snapshot in the
+        background. Those that fail are removed from the pool.
+        """
+        if self._recheck and self._checker is None:
+            semaphore = asyncio.Semaphore(self._concurrency)
+            proxies, self._recheck = self._recheck, []
+            self._checker = asyncio.ensure_future(
+                asyncio.gather(*[self._test(semaphore, p) for p in proxies], return_exceptions=True))
+
+
+    async def _fetch(self, site, start=1, end=10):
+        """
+        Scrape the proxies from a source site into the pool as untested ones.
+
+        :returns: a list of the proxies
+        """
         number = end - start
-        response = requests.get(self._sources[site])
-        soup = BeautifulSoup(response.text, 'lxml')
-        first_proxy = soup.find(id='proxylisttable').find('tbody').find('tr')
+        try:
+            async with self._get_sessions().session().get(self._sources[site]) as response:
+                source_code = await response.text('utf-8')
+        except Exception as e:
+            print('Unable to fetch proxies from ' + self._sources[site] + ': ' + str(e))
+            return []
+        soup = BeautifulSoup(source_code, 'lxml')
+        table = soup.find(id='proxylisttable')
+        if table is None or table.find('tbody') is None or table.find('tbody').find('tr') is None:
+            print('Unexpected proxy list: ' + self._sources[site])
+            return []
+        first_proxy = table.find('tbody').find('tr')
         for i in range(start-1):
             first_proxy = first_proxy.find_next_sibling('tr')            # get the proxy of index 'start'
         proxylist = first_proxy.find_next_siblings('tr', limit=number)   # find the next n-1 proxies
         proxylist.insert(0, first_proxy)                # insert the first proxy to the start of the list
+        proxies = []
         for item in proxylist:
             proxy = item.find('td').find(text=True) + ':' + item.find('td').find_next_sibling('td').find(text=True)
-            self._pool[proxy] = False
+            proxies.append(proxy)
+            self._pool.setdefault(proxy, ProxyHealth())
+        return proxies
+
+
+    async def _fetch_all(self):
+        """
+        Scrape all the source sites at the same time.
+        """
+        print('Fetching proxies...')
+        await asyncio.gather(*[self._fetch(i, 1, self._limits[i]) for i in range(len(self._sources))])
 
 
     async def _connect(self, url, proxy, raw=False):
         soup = ''
         status = 0
-        async with aiohttp.ClientSession(read_timeout=5) as session:
-            try:
-                async with session.get(url, proxy='http://'+proxy) as response:
-                    source_code = await response.text('utf-8')
-                    status = response.status
-                    soup = source_code if raw else BeautifulSoup(source_code, 'lxml')
-            except:
-                soup = None
-            finally:
-                return (soup, status, proxy)
-
-
-    async def _update(self):
-        if len(self._pool) == 0:
-            print('Need to fetch proxies first.')
+        session = self._get_sessions().session('http://' + proxy)
+        try:
+            async with session.get(url, proxy='http://'+proxy, timeout=aiohttp.ClientTimeout(total=self._timeout)) as response:
+                source_code = await response.text('utf-8')
+                status = response.status
+                soup = source_code if raw else BeautifulSoup(source_code, 'lxml')
+        except Exception:    # let the cancellation pass through
+            soup = None
+        return (soup, status, proxy)
+
+
+    async def _test(self, semaphore, proxy, revalidate=False):
+        """
+        Test a proxy. A new proxy is removed if it fails, while a proxy in
+        use only records the failure, which may bench it.
+        """
+        async with semaphore:
+            start = time.monotonic()
+            soup, status, proxy = await self._connect(self._ip_test, proxy, raw=True)
+            latency = time.monotonic() - start
+        ok = soup is not None and status < 400
+        health = self._pool.get(proxy)
+        if health is None:
+            return
+        if ok or revalidate:
+            health.tested = True
+            health.record(ok, latency, self._max_failures, self._bench_time)
+        else:
+            self._pool.pop(proxy, None)
+
+
+    async def _update(self, number):
+        """
+        Test the untested proxies in the pool, at most '_concurrency' at the
+        same time. It returns as soon as 'number' proxies are available, and
+        the rest are left untested for the next time.
+        """
+        untested = [p for p, health in self._pool.items() if not health.tested]
+        if not untested:
             return
         print('Updating proxy list...')
-        tasks = []
-        for proxy in self._pool:
-            task = asyncio.ensure_future(self._connect(self._ip_test, proxy))
-            tasks.append(task)
-        await asyncio.gather(*tasks)
-
-        for task in tasks:
-            (soup, status, proxy) = task.result()
-            if soup is not None and status < 400:
-                self._pool[proxy] = True
-            else:
-                del self._pool[proxy]
+        semaphore = asyncio.Semaphore(self._concurrency)
+        tasks = [asyncio.ensure_future(self._test(semaphore, p)) for p in untested]
+        try:
+            for task in asyncio.as_completed(tasks):
+                await task
+                if self.available >= number:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 
     async def _available(self, number):
+        self._check_snapshot()
         if number <= 0:
             return
         print('Need ' + str(number) + (' proxy' if number==1 else ' proxies'))
-        await self._update()
-        if self.num >= number:
-            print('Found ' + str(self.num) + (' proxy' if self.num==1 else ' proxies'))
-            return
-        for i in range(len(self._sources)):
-            self._fetch(i, 1, self._limits[i])
-            await self._update()
-            if self.num >= number:
-                print('Found ' + str(self.num) + (' proxy' if self.num==1 else ' proxies'))
-                return
-        print('No available proxies')
+        if self.available < number:
+            await self._update(number)
+        if self.available < number:
+            await self._fetch_all()
+            await self._update(number)
+        if self.available >= number:
+            print('Found ' + str(self.available) + (' proxy' if self.available==1 else ' proxies'))
+        else:
+            print('No available proxies' if self.available == 0 else 'Only found ' + str(self.available) +
+                  (' proxy' if self.available==1 else ' proxies'))
 
 
     async def get_proxy(self):
         await self._available(1)
-        return 'http://' + list(self.pool)[0]   # returns the url of a proxy
+        proxies = self._healthy()
+        return 'http://' + proxies[0] if proxies else None   # returns the url of a proxy
 
 
     async def get_proxies(self, number):
         await self._available(number)
-        proxies = ['http://'+p for p in list(self.pool)[0:number]]
-        return proxies   # returns a list of the url of proxies
+        proxies = ['http://'+p for p in self._rank(self._healthy())[0:number]]
+        return proxies   # returns a list of the url of proxies, the best first
+
+
+    def _healthy(self):
+        return [p for p, health in self._pool.items() if health.tested and not health.benched]
+
+
+    def _rank(self, proxies):
+        """
+        Order the proxies by '_selection'. 'least-latency' puts the proxies
+        with the lowest score first, 'weighted' shuffles them randomly with
+        the weights inversely proportional to the scores, so the load is
+        spread while the fast proxies still get most of it.
+        """
+        if self._selection == 'weighted':
+            keys = {p: random.random() ** self._pool[p].score for p in proxies}   # weighted random sampling
+            return sorted(proxies, key=lambda p: keys[p], reverse=True)
+        return sorted(proxies, key=lambda p: self._pool[p].score)
+
+
+    def _key(self, proxy):
+        return proxy[len('http://'):] if proxy.startswith('http://') else proxy
+
+
+    def select(self, candidates, tried=()):
+        """
+        Choose a proxy for the next attempt of a request.
+        The proxies tried already and the benched ones are avoided if
+        possible. None (the local IP address) is chosen only if no proxy
+        is left.
+
+        :param candidates: the proxies' urls to choose from
+        :param tried: the proxies' urls tried by the earlier attempts
+        :returns: the url of a proxy, or None
+        """
+        fresh = [p for p in candidates if p not in tried] or list(candidates)
+        proxies = [p for p in fresh if p is not None and self._key(p) in self._pool]
+        usable = [p for p in proxies if not self._pool[self._key(p)].benched] or proxies
+        if not usable:
+            return fresh[0] if fresh else None
+        ranked = self._rank([self._key(p) for p in usable])
+        return 'http://' + ranked[0]
+
+
+    def report(self, proxy, ok, latency):
+        """
+        Record the outcome of a request sent through a proxy.
+
+        :param proxy: the proxy's url
+        :param ok: False if the request failed because of the proxy
+        :param latency: the seconds spent on the request
+        """
+        if proxy is None:
+            return
+        health = self._pool.get(self._key(proxy))
+        if health is not None:
+            health.record(ok, latency, self._max_failures, self._bench_time)
+
+
+    def start_revalidation(self, interval):
+        """
+        Retest the proxies in the background every 'interval' seconds, so a
+        benched proxy can come back and a dead one gets benched before the
+        crawler runs into it.
+        """
+        if self._revalidator is None:
+            self._revalidator = asyncio.ensure_future(self._revalidate(interval))
+
+
+    async def stop_revalidation(self):
+        if self._checker is not None:
+            self._checker.cancel()
+            await asyncio.gather(self._checker, return_exceptions=True)
+            self._checker = None
+        if self._revalidator is not None:
+            self._revalidator.cancel()
+            await asyncio.gather(self._revalidator, return_exceptions=True)
+            self._revalidator = None
+
+
+    async def _revalidate(self, interval):
+        semaphore = asyncio.Semaphore(self._concurrency)
+        while True:
+            await asyncio.sleep(interval)
+            deadline = time.time() - interval
+            stale = [p for p, health in self._pool.items() if health.tested and health.last_checked < deadline]
+            await asyncio.gather(*[self._test(semaphore, p, revalidate=True) for p in stale])
 
 
 async def test():
     pool = ProxyPool()
     print(await pool.get_proxy())
     print(await pool.get_proxy())
+    await pool.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+import io
+import gzip
+import json
+try:
+    import zstandard
+except ImportError:     # only needed for the '.zst' files
+    zstandard = None
+
+
+class RecordWriter:
+    """
+    Write one JSON record per line, with streaming compression.
+
+    The compression is chosen by the extension of the file name:
+    '.gz' for gzip, '.zst' for zstd (requires the zstandard module), and
+    no compression otherwise. The records are compressed while they are
+    written, so the whole output never stays in memory. Appending to a
+    compressed file adds a new gzip member or zstd frame, which is still
+    readable as one stream.
+    """
+
+    def __init__(self, filename, append=False):
+        self._filename = filename
+        self._count = 0
+        mode = 'a' if append else 'w'
+        if filename.endswith('.gz'):
+            self._file = gzip.open(filename, mode + 't', encoding='UTF-8')
+        elif filename.endswith('.zst'):
+            if zstandard is None:
+                raise ImportError('The zstandard module is required for "{}": pip install zstandard'.format(filename))
+            raw = open(filename, mode + 'b')
+            self._file = io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw), encoding='UTF-8')
+        else:
+            self._file = open(filename, mode, encoding='UTF-8', buffering=1 << 16)
+
+
+    @property
+    def filename(self):
+        return self._filename
+
+
+    @property
+    def count(self):
+        return self._count
+
+
+    def write(self, record):
+        """
+        :param record: a dictionary
+        """
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._count += 1
+
+
+    def flush(self):
+        self._file.flush()
+
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+def read_records(filename):
+    """
+    Read the records written by RecordWriter.
+
+    :returns: an iterator over the dictionaries
+    """
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'rt', encoding='UTF-8')
+    elif filename.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('The zstandard module is required for "{}": pip install zstandard'.format(filename))
+        raw = open(filename, 'rb')
+        f = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True), encoding='UTF-8')
+    else:
+        f = open(filename, 'r', encoding='UTF-8')
+    with f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,155 @@
+import time
+import zlib
+import sqlite3
+
+
+class ResponseCache:
+    """
+    A persistent cache of the HTTP responses, keyed by URL.
+    The response bodies are compressed with zlib and stored in a SQLite
+    database, together with the validators (ETag and Last-Modified) sent
+    by the server. The writes are committed every 100 of them and on
+    'commit', so the crawling doesn't wait for the disk on each response.
+
+    A response younger than '_ttl' seconds is served from the disk directly.
+    An older one is revalidated with a conditional request if the server has
+    sent any validator; otherwise it's fetched again. When the total size of
+    the compressed bodies exceeds '_max_size' bytes at a commit, the least
+    recently used responses are evicted.
+    """
+
+    def __init__(self, filename, ttl=86400, max_size=512 * 2**20):
+        self._filename = filename
+        self._ttl = ttl
+        self._max_size = max_size
+        self._hits = 0
+        self._misses = 0
+        self._revalidated = 0
+        self._pending = 0
+        self._db = sqlite3.connect(filename)
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'url TEXT PRIMARY KEY, body BLOB, status INTEGER, etag TEXT, last_modified TEXT, '
+                         'stored_at REAL, accessed_at REAL, size INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS lru ON responses (accessed_at)')
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+
+    @property
+    def filename(self):
+        return self._filename
+
+
+    @property
+    def hits(self):
+        return self._hits
+
+
+    @property
+    def misses(self):
+        return self._misses
+
+
+    @property
+    def revalidated(self):
+        return self._revalidated
+
+
+    def get(self, url):
+        """
+        Look up the cached response of a URL.
+
+        :returns: a tuple of (body, status, fresh, headers), None if not cached.
+        'fresh' tells whether the response can be used without a request,
+        'headers' are the conditional request headers for revalidation.
+        """
+        row = self._db.execute('SELECT body, status, etag, last_modified, stored_at FROM responses WHERE url = ?',
+                               (url,)).fetchone()
+        if row is None:
+            self._misses += 1
+            return None
+        body, status, etag, last_modified, stored_at = row
+        fresh = time.time() - stored_at < self._ttl
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        if fresh:
+            self._hits += 1
+            self._db.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (time.time(), url))
+            self._written()
+        else:
+            self._misses += 1    # turns into a revalidation if the server replies 304
+            if not headers:      # no way to revalidate
+                return None
+        return zlib.decompress(body), status, fresh, headers
+
+
+    def put(self, url, body, status, headers):
+        """
+        Store a response.
+
+        :param body: the undecoded response body
+        :param headers: the response headers
+        """
+        data = zlib.compress(body)
+        now = time.time()
+        old = self._db.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+        if old is not None:
+            self._size -= old[0]
+        self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (url, data, status, headers.get('ETag'), headers.get('Last-Modified'), now, now, len(data)))
+        self._size += len(data)
+        self._written()
+
+
+    def refresh(self, url):
+        """
+        Mark a cached response as fresh after the server replied
+        '304 Not Modified'.
+        """
+        self._misses -= 1
+        self._revalidated += 1
+        now = time.time()
+        self._db.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+        self._written()
+
+
+    def _written(self):
+        self._pending += 1
+        if self._pending >= 100:
+            self.commit()
+
+
+    def _evict(self):
+        """
+        Remove the least recently used responses until the cache fits in
+        '_max_size'.
+        """
+        while self._size > self._max_size:
+            rows = self._db.execute('SELECT url, size FROM responses ORDER BY accessed_at LIMIT 100').fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for url, size in rows:
+                self._db.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self._size -= size
+                if self._size <= self._max_size:
+                    return
+
+
+    def commit(self):
+        self._evict()
+        self._db.commit()
+        self._pending = 0
+
+
+    def close(self):
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+    def report(self):
+        print('Cache: {} hits, {} revalidated, {} misses'.format(self._hits, self._revalidated, self._misses))
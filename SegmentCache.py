@@ -0,0 +1,133 @@
+import time
+import hashlib
+import sqlite3
+
+
+class SegmentCache:
+    """
+    A persistent cache of jieba's words, keyed by the content of the text.
+
+    The key of a text is the hash of the dictionary's version and the text
+    itself, so the same sentence found by another crawling is never
+    segmented again, and changing the dictionary never gives stale words.
+    The words are stored in a SQLite database. When the total size of them
+    exceeds '_max_size' bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, filename, version, max_size=256 * 2**20):
+        """
+        :param version: the version of the dictionary, see 'Segmenter.version'
+        """
+        self._filename = filename
+        self._max_size = max_size
+        self._seed = hashlib.blake2b(version.encode('utf-8') + b'\0', digest_size=16)
+        self._hits = 0
+        self._misses = 0
+        self._hit_chars = 0
+        self._miss_chars = 0
+        self._pending = 0
+        self._db = sqlite3.connect(filename)
+        self._db.execute('CREATE TABLE IF NOT EXISTS segments (key BLOB PRIMARY KEY, words TEXT, accessed_at REAL, size INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS lru ON segments (accessed_at)')
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM segments').fetchone()[0]
+
+
+    @property
+    def filename(self):
+        return self._filename
+
+
+    @property
+    def hits(self):
+        return self._hits
+
+
+    @property
+    def misses(self):
+        return self._misses
+
+
+    def key(self, text):
+        h = self._seed.copy()
+        h.update(text.encode('utf-8'))
+        return h.digest()
+
+
+    def get_many(self, texts, keys):
+        """
+        Look up the words of many texts at once.
+
+        :param keys: the keys of the texts
+        :returns: a dictionary of {key: list of words} of the cached texts
+        """
+        found = {}
+        unique = list(set(keys))
+        for i in range(0, len(unique), 500):    # below SQLite's limit of the variables
+            chunk = unique[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            rows = self._db.execute('SELECT key, words FROM segments WHERE key IN ({})'.format(marks), chunk).fetchall()
+            for key, words in rows:
+                found[key] = words.split(' ') if words else []
+            if rows:
+                self._db.execute('UPDATE segments SET accessed_at = ? WHERE key IN ({})'.format(marks), [time.time()] + chunk)
+        for text, key in zip(texts, keys):
+            if key in found:
+                self._hits += 1
+                self._hit_chars += len(text)
+            else:
+                self._misses += 1
+                self._miss_chars += len(text)
+        return found
+
+
+    def put(self, key, words):
+        """
+        :param words: a list of words without whitespaces
+        """
+        data = ' '.join(words)
+        size = len(data.encode('utf-8')) + len(key)
+        old = self._db.execute('SELECT size FROM segments WHERE key = ?', (key,)).fetchone()
+        if old is not None:
+            self._size -= old[0]
+        self._db.execute('INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?)', (key, data, time.time(), size))
+        self._size += size
+        self._pending += 1
+        if self._pending >= 10000:
+            self.commit()
+
+
+    def _evict(self):
+        """
+        Remove the least recently used words until the cache fits in
+        '_max_size'.
+        """
+        while self._size > self._max_size:
+            rows = self._db.execute('SELECT key, size FROM segments ORDER BY accessed_at LIMIT 1000').fetchall()
+            if not rows:
+                self._size = 0
+                return
+            for key, size in rows:
+                self._db.execute('DELETE FROM segments WHERE key = ?', (key,))
+                self._size -= size
+                if self._size <= self._max_size:
+                    return
+
+
+    def commit(self):
+        self._evict()
+        self._db.commit()
+        self._pending = 0
+
+
+    def close(self):
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+    def report(self):
+        total = self._hits + self._misses
+        chars = self._hit_chars + self._miss_chars
+        print('Segment cache: {} hits, {} misses, {:.1%} of the texts and {:.1%} of the characters from the cache'.format(
+              self._hits, self._misses, self._hits / max(total, 1), self._hit_chars / max(chars, 1)))
@@ -0,0 +1,244 @@
+import os
+import hashlib
+import logging
+import collections
+import jieba
+import SegmentCache
+from concurrent.futures import ProcessPoolExecutor
+
+
+class Segmenter:
+    """
+    Split the texts into words with jieba in a process pool.
+
+    Each worker loads the dictionary once when it starts, instead of once
+    for each call. The texts are sent to the workers in batches of about
+    'batch_size' characters, and the words come back in the order of the
+    texts. Only a few batches are in flight at a time, so the texts can be
+    an iterator over a corpus larger than the memory.
+    Jieba never joins the characters on both sides of a '，' into a word,
+    so segmenting the sentences one by one gives the same words as
+    segmenting the whole corpus at once.
+    """
+
+    def __init__(self, dictionary=None, workers=None, batch_size=1 << 16):
+        """
+        :param dictionary: the path of jieba's dictionary, e.g. 'dict.txt.big'
+                           for traditional Chinese, None for jieba's default one
+        :param workers: the number of worker processes, the number of CPUs if
+                        None, and 1 to segment in this process
+        :param batch_size: the characters sent to a worker at a time
+        """
+        if dictionary is not None and not os.path.isfile(dictionary):
+            raise FileNotFoundError('The dictionary "{}" doesn\'t exist'.format(dictionary))
+        self._dictionary = dictionary
+        self._workers = workers or os.cpu_count() or 1
+        self._batch_size = batch_size
+        self._executor = None
+        self._tokenizer = None
+        self._cache = None
+        self._version = None
+
+
+    @property
+    def dictionary(self):
+        return self._dictionary
+
+
+    @property
+    def cache(self):
+        return self._cache
+
+
+    @property
+    def version(self):
+        """
+        The hash of jieba's version and the content of the dictionary.
+        """
+        if self._version is None:
+            h = hashlib.sha1(jieba.__version__.encode('utf-8'))
+            with jieba.Tokenizer(self._dictionary).get_dict_file() as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            self._version = h.hexdigest()
+        return self._version
+
+
+    def use_cache(self, filename, max_size=256 * 2**20):
+        """
+        Keep the words of the texts on the disk, so only the texts never
+        seen before are segmented.
+
+        :param filename: the cache database
+        :param max_size: the maximum bytes of the words
+        """
+        self._cache = SegmentCache.SegmentCache(filename, self.version, max_size)
+
+
+    @property
+    def workers(self):
+        return self._workers
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def segment(self, texts):
+        """
+        :param texts: an iterable of strings, e.g. the sentences or the articles
+        :returns: an iterator over the lists of words, one for each text
+        """
+        if self._cache is None:
+            return self._segment(texts)
+        return self._segment_cached(texts)
+
+
+    def _segment_cached(self, texts):
+        """
+        Look up the texts in the cache a block at a time, and only send the
+        missing ones to '_segment'. A block is yielded when the words of all
+        its missing texts are back, so the order of the texts is kept while
+        the workers run ahead.
+        """
+        blocks = collections.deque()
+
+        def missing():
+            for texts_ in self._batches(texts, 1000):
+                keys = [self._cache.key(text) for text in texts_]
+                found = self._cache.get_many(texts_, keys)
+                todo = {}       # {key: text}, a text repeated in the block is segmented once
+                for text, key in zip(texts_, keys):
+                    if key not in found:
+                        todo.setdefault(key, text)
+                blocks.append((keys, found, list(todo), len(found) + len(todo)))
+                yield from todo.values()
+
+        def flush():
+            while blocks and len(blocks[0][1]) == blocks[0][3]:
+                keys, found, todo, size = blocks.popleft()
+                yield from (found[key] for key in keys)
+
+        filled = 0      # the missing texts of the first unfinished block that are back
+        try:
+            for words in self._segment(missing()):
+                yield from flush()
+                keys, found, todo, size = blocks[0]
+                found[todo[filled]] = words
+                self._cache.put(todo[filled], words)
+                filled += 1
+                if filled == len(todo):
+                    filled = 0
+                    yield from flush()
+            yield from flush()
+        finally:
+            self._cache.commit()
+
+
+    def _segment(self, texts):
+        """
+        The dictionary is only loaded when there's something to segment, so
+        a run served by the cache entirely never loads it.
+        """
+        if self._workers == 1:
+            for batch in self._batches(texts):
+                if self._tokenizer is None:
+                    self._tokenizer = _load(self._dictionary)
+                yield from _cut(self._tokenizer, batch)
+            return
+        pending = collections.deque()
+        for batch in self._batches(texts):
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self._workers, initializer=_init_worker, initargs=(self._dictionary,))
+            pending.append(self._executor.submit(_segment_batch, batch))
+            if len(pending) >= 2 * self._workers:   # keep the workers busy without reading ahead too far
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+    def cut(self, text):
+        """
+        Split a text on '，' and segment the sentences.
+
+        :returns: a list of the lists of words, one for each sentence
+        """
+        return list(self.segment(text.split('，')))
+
+
+    def _batches(self, texts, count=None):
+        """
+        :param count: the maximum number of texts in a batch, or the batches
+                      are only limited by their characters
+        """
+        batch = []
+        size = 0
+        for text in texts:
+            batch.append(text)
+            size += len(text)
+            if size >= self._batch_size or len(batch) == count:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._cache is not None:
+            self._cache.close()
+
+
+def _load(dictionary):
+    tokenizer = jieba.Tokenizer(dictionary)
+    tokenizer.initialize()
+    return tokenizer
+
+
+def _cut(tokenizer, texts):
+    """
+    Segment a batch of texts in one call of jieba, since each call costs
+    much more than a short sentence does. The texts are joined by '\\0',
+    which jieba always keeps as a word of its own.
+
+    :returns: a list of the lists of words, one for each text
+    """
+    if any(_separator in text for text in texts):
+        return [_cut_one(tokenizer, text) for text in texts]
+    result = [[]]
+    for word in tokenizer.cut(_separator.join(texts), cut_all=False):     # 精確模式
+        if word == _separator:
+            result.append([])
+        elif not word.isspace():
+            result[-1].append(word)
+    return result
+
+
+def _cut_one(tokenizer, text):
+    return [word for word in tokenizer.cut(text, cut_all=False) if not word.isspace()]
+
+
+_separator = '\0'
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(dictionary):
+    """
+    Load the dictionary in each worker process once.
+    """
+    global _worker_tokenizer
+    jieba.setLogLevel(logging.WARNING)
+    _worker_tokenizer = _load(dictionary)
+
+
+def _segment_batch(texts):
+    return _cut(_worker_tokenizer, texts)
@@ -0,0 +1,102 @@
+import aiohttp
+
+
+class SessionManager:
+    """
+    The HTTP sessions shared by the whole crawling.
+
+    Each proxy (and the local IP address) gets its own long-lived session
+    with a pooled connector, so the keep-alive connections, TLS sessions
+    and DNS results are reused by all phases of the crawling, and by the
+    proxy pool which tests the same proxies before the crawler uses them.
+
+    The sessions are created lazily since a ClientSession needs a running
+    event loop. Remember to 'close' the manager at the end.
+    """
+
+    def __init__(self, timeout=25, limit_per_host=0, dns_ttl=300, keepalive=30):
+        self._timeout = timeout
+        self._limit_per_host = limit_per_host
+        self._dns_ttl = dns_ttl
+        self._keepalive = keepalive
+        self._sessions = {}
+        self._requests = 0
+        self._created = 0
+        self._reused = 0
+        self._dns_hits = 0
+        self._dns_misses = 0
+        self._trace = aiohttp.TraceConfig()
+        self._trace.on_request_start.append(self._on_request_start)
+        self._trace.on_connection_create_end.append(self._on_connection_create)
+        self._trace.on_connection_reuseconn.append(self._on_connection_reuse)
+        self._trace.on_dns_cache_hit.append(self._on_dns_hit)
+        self._trace.on_dns_cache_miss.append(self._on_dns_miss)
+
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+
+    @property
+    def requests(self):
+        return self._requests
+
+
+    @property
+    def created(self):
+        return self._created
+
+
+    @property
+    def reused(self):
+        return self._reused
+
+
+    def session(self, proxy=None):
+        """
+        :param proxy: the proxy's url, None for the local IP address
+        :returns: the ClientSession for the proxy
+        """
+        session = self._sessions.get(proxy)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self._limit_per_host,
+                                             ttl_dns_cache=self._dns_ttl, keepalive_timeout=self._keepalive)
+            session = aiohttp.ClientSession(connector=connector,    # the timeout is the acceptable time for
+                                            timeout=aiohttp.ClientTimeout(total=self._timeout),    # the server's response
+                                            trace_configs=[self._trace])
+            self._sessions[proxy] = session
+        return session
+
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+    async def _on_request_start(self, session, context, params):
+        self._requests += 1
+
+
+    async def _on_connection_create(self, session, context, params):
+        self._created += 1
+
+
+    async def _on_connection_reuse(self, session, context, params):
+        self._reused += 1
+
+
+    async def _on_dns_hit(self, session, context, params):
+        self._dns_hits += 1
+
+
+    async def _on_dns_miss(self, session, context, params):
+        self._dns_misses += 1
+
+
+    def report(self):
+        per_request = self._created / self._requests if self._requests else 0
+        print('Connections: {} requests, {} new connections, {} reused ({:.2f} handshakes per request)'.format(
+              self._requests, self._created, self._reused, per_request))
+        print('DNS cache: {} hits, {} misses'.format(self._dns_hits, self._dns_misses))
@@ -0,0 +1,166 @@
+import time
+import sqlite3
+
+
+class WorkQueue:
+    """
+    A work queue shared by the processes of a sharded crawling, stored in a
+    SQLite database.
+
+    The tasks are the search pages and the articles' links found on them.
+    A worker leases a few tasks at a time and has to renew the leases while
+    it's working on them. If a worker dies, its leases expire and the tasks
+    are leased to the other workers again. A task leased more than
+    'max_attempts' times is given up, so a task that kills the workers
+    won't be passed around forever.
+
+    The text of each article is kept with its task, and the coordinator
+    merges them into the output file when the queue is finished.
+    Workers on other machines can share the queue through a network file
+    system that supports the file locks of SQLite.
+    """
+
+    def __init__(self, filename, max_attempts=3):
+        self._filename = filename
+        self._max_attempts = max_attempts
+        self._db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, payload TEXT, status TEXT,
+                worker TEXT, lease_until REAL, attempts INTEGER, http_status INTEGER, text TEXT,
+                UNIQUE (kind, payload));
+            CREATE INDEX IF NOT EXISTS pending ON tasks (status, lease_until);
+        ''')
+
+
+    @property
+    def filename(self):
+        return self._filename
+
+
+    @property
+    def keyword(self):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', ('keyword',)).fetchone()
+        return row[0] if row is not None else None
+
+
+    def setup(self, keyword, pages):
+        """
+        Put the search pages of a keyword into the queue.
+        The pages already in the queue are kept, so a sharded crawling can be
+        resumed with the same file.
+
+        :param pages: the page indexes
+        """
+        old = self.keyword
+        if old is not None and old != keyword:
+            raise ValueError('The queue "{}" belongs to the keyword "{}"'.format(self._filename, old))
+        self._db.execute('BEGIN IMMEDIATE')
+        self._db.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('keyword', keyword))
+        self._put('page', [str(page) for page in pages])
+        self._db.execute('COMMIT')
+
+
+    def _put(self, kind, payloads):
+        self._db.executemany('INSERT OR IGNORE INTO tasks (kind, payload, status, attempts) VALUES (?, ?, ?, 0)',
+                             ((kind, p, 'pending') for p in payloads))
+
+
+    def lease(self, worker, number, lease_time):
+        """
+        Lease the pending tasks, and the ones whose leases have expired.
+
+        :param worker: the name of the worker
+        :param number: the maximum number of tasks
+        :param lease_time: the seconds before the leases expire
+        :returns: a list of tuples of (id, kind, payload)
+        """
+        if number <= 0:
+            return []
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.execute('UPDATE tasks SET status = ? WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                             ('failed', 'leased', now, self._max_attempts))
+            tasks = self._db.execute('SELECT id, kind, payload FROM tasks WHERE status = ? OR (status = ? AND lease_until < ?) '
+                                     'ORDER BY kind DESC, id LIMIT ?',    # the pages first
+                                     ('pending', 'leased', now, number)).fetchall()
+            self._db.executemany('UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?',
+                                 (('leased', worker, now + lease_time, task[0]) for task in tasks))
+        finally:
+            self._db.execute('COMMIT')
+        return tasks
+
+
+    def renew(self, worker, lease_time):
+        """
+        Extend all leases held by a worker.
+        """
+        self._db.execute('UPDATE tasks SET lease_until = ? WHERE status = ? AND worker = ?',
+                         (time.time() + lease_time, 'leased', worker))
+
+
+    def complete_page(self, task_id, links):
+        """
+        Finish a search page and put the articles' links on it into the queue.
+        """
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._put('article', links)
+            self._db.execute('UPDATE tasks SET status = ? WHERE id = ? AND status = ?', ('done', task_id, 'leased'))
+        finally:
+            self._db.execute('COMMIT')
+
+
+    def complete_article(self, task_id, http_status, text):
+        """
+        Finish an article with its text, or mark it as failed if the text is
+        None. Only the first worker finishing a task counts.
+        """
+        status = 'failed' if text is None else 'done'
+        self._db.execute('UPDATE tasks SET status = ?, http_status = ?, text = ? WHERE id = ? AND status = ?',
+                         (status, http_status, text, task_id, 'leased'))
+
+
+    def fail(self, task_id):
+        self._db.execute('UPDATE tasks SET status = ? WHERE id = ? AND status = ?', ('failed', task_id, 'leased'))
+
+
+    def release(self, task_id):
+        """
+        Give a task back to be leased again, e.g. after the server answered
+        with an error. It's given up after 'max_attempts' leases.
+        """
+        self._db.execute('UPDATE tasks SET status = CASE WHEN attempts < ? THEN ? ELSE ? END WHERE id = ? AND status = ?',
+                         (self._max_attempts, 'pending', 'failed', task_id, 'leased'))
+
+
+    def finished(self):
+        """
+        :returns: True if there's no task pending or being worked on
+        """
+        return self._db.execute('SELECT 1 FROM tasks WHERE status IN (?, ?) LIMIT 1',
+                                ('pending', 'leased')).fetchone() is None
+
+
+    def texts(self):
+        """
+        :returns: an iterator over the articles' texts in the order they are found
+        """
+        return (row[0] for row in self._db.execute('SELECT text FROM tasks WHERE kind = ? AND status = ? ORDER BY id',
+                                                   ('article', 'done')))
+
+
+    def counts(self):
+        """
+        :returns: a dictionary of {(kind, status): the number of tasks}
+        """
+        return {(kind, status): n for kind, status, n in
+                self._db.execute('SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status')}
+
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,245 @@
+import io
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+from aiohttp import web
+from urllib.parse import quote
+import Metrics
+from PixnetCrawler import PixnetCrawler
+
+
+# the crawler options of each configuration, set through the properties
+CONFIGS = {
+    'baseline': {},
+    'pipeline': {'pipeline': True},
+    'pool': {'parser': 'pool'},
+    'stream': {'stream': True},
+    'pipeline-pool-stream': {'pipeline': True, 'parser': 'pool', 'stream': True},
+}
+
+
+class StubServer:
+    """
+    A local stand-in of Pixnet, Hares and the proxy lists.
+
+    It serves the search result pages, the Pixnet articles, the Hares pages
+    with their '繼續閱讀全文' links and the Hares articles, with a
+    configurable latency, error rate and page size. The same server also
+    listens on the ports of the fake proxies, which accept the requests in
+    the proxy form, so 'hares.tw' can be reached through them without a
+    network.
+    """
+
+    def __init__(self, port=8765, proxies=5, pages=10, per_page=20, hares_ratio=0.3,
+                 latency=0.05, jitter=0.5, error_rate=0.0, size=20000, seed=0):
+        self._port = port
+        self._proxy_ports = [port + 1 + i for i in range(proxies)]
+        self._pages = pages
+        self._per_page = per_page
+        self._hares_ratio = hares_ratio
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._size = size
+        self._random = random.Random(seed)
+        self._runner = None
+
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._port)
+
+
+    @property
+    def articles(self):
+        return self._pages * self._per_page
+
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/searcharticle', self._search)
+        app.router.add_get('/pixnet/{n}', self._pixnet)
+        app.router.add_get('/hare48.pixnet.net/{n}', self._hares_page)
+        app.router.add_get('/archives/{n}', self._hares_article)
+        app.router.add_get('/proxylist', self._proxy_list)
+        app.router.add_get('/ip', self._ip)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        for port in [self._port] + self._proxy_ports:
+            await web.TCPSite(self._runner, '127.0.0.1', port).start()
+
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+    async def _delay(self):
+        """
+        Wait for the latency, and decide if the request fails.
+
+        :returns: an error response, None if the request succeeds
+        """
+        await asyncio.sleep(self._latency * (1 + self._jitter * (2 * self._random.random() - 1)))
+        if self._random.random() < self._error_rate:
+            return web.Response(status=503)
+        return None
+
+
+    def _text(self, n, length):
+        words = ['好吃', '拉麵', '湯頭', '叉燒', '推薦', '餐廳', '台北', '甜點', '咖啡', '早午餐']
+        r = random.Random(n)
+        return '，'.join(r.choice(words) + str(i % 10) for i in range(length // 8))
+
+
+    async def _search(self, request):
+        error = await self._delay()
+        if error is not None:
+            return error
+        page = int(request.query.get('page', 1))
+        links = []
+        if 1 <= page <= self._pages:
+            for i in range(self._per_page):
+                n = page * 1000 + i
+                if random.Random(n).random() < self._hares_ratio:
+                    url = '{}/hare48.pixnet.net/{}'.format(self.url, n)
+                else:
+                    url = '{}/pixnet/{}'.format(self.url, n)
+                links.append('<li class="search-title"><a href="/r?url={}">標題{}</a></li>'.format(quote(url, safe=''), n))
+        return web.Response(text='<html><body><ul>{}</ul></body></html>'.format(''.join(links)), content_type='text/html')
+
+
+    async def _pixnet(self, request):
+        error = await self._delay()
+        if error is not None:
+            return error
+        n = int(request.match_info['n'])
+        return web.Response(text='<html><body><h2 class="title">標題{}</h2><div class="article-content-inner">{}</div>'
+                                 '</body></html>'.format(n, self._text(n, self._size)), content_type='text/html')
+
+
+    async def _hares_page(self, request):
+        error = await self._delay()
+        if error is not None:
+            return error
+        n = int(request.match_info['n'])
+        return web.Response(text='<html><body><a href="http://hares.tw/archives/{}">繼續閱讀全文</a>{}</body></html>'.format(
+                                 n, '<p>' + self._text(n + 1, self._size) + '</p>'), content_type='text/html')
+
+
+    async def _hares_article(self, request):
+        error = await self._delay()
+        if error is not None:
+            return error
+        n = int(request.match_info['n'])
+        return web.Response(text='<html><body><h1 class="entry-title">標題{}</h1><div class="entry-content">{}</div>'
+                                 '</body></html>'.format(n, self._text(n, self._size)), content_type='text/html')
+
+
+    async def _proxy_list(self, request):
+        rows = ''.join('<tr><td>127.0.0.1</td><td>{}</td></tr>'.format(p) for p in self._proxy_ports)
+        return web.Response(text='<table id="proxylisttable"><tbody>{}</tbody></table>'.format(rows), content_type='text/html')
+
+
+    async def _ip(self, request):
+        return web.json_response({'origin': '127.0.0.1'})
+
+
+def _crawl(url, proxies, options, results):
+    """
+    Run a crawling against the stub server in a new process, so each
+    configuration gets its own peak RSS.
+
+    :param url: the stub server's url
+    :param options: a dictionary of the crawler's properties
+    :param results: a queue to put the measurement into
+    """
+    logging.basicConfig(level=logging.ERROR)
+    with tempfile.TemporaryDirectory() as folder:
+        pc = PixnetCrawler()
+        pc.keyword = 'benchmark'
+        pc.start = 1
+        pc.end = options.pop('end')
+        pc.timeout = 10
+        pc.recon = options.pop('recon')
+        pc.filename = folder + '/output.txt'
+        for name, value in options.items():
+            setattr(pc, name, value)
+        pc._search_site = url
+        pc._pool._sources = [url + '/proxylist']
+        pc._pool._limits = [proxies]
+        pc._pool._ip_test = url + '/ip'
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(pc.crawl())
+        elapsed = time.time() - start
+        metrics = pc._metrics
+        requests = Metrics.Histogram.merged(metrics.histogram('request_seconds').values())
+        articles = sum(h.count for h in metrics.histogram('parse_seconds').values())
+    results.put({'elapsed': elapsed, 'requests': requests.count, 'articles': articles,
+                 'failed': sum(metrics.counter('failed_articles').values()),
+                 'p50': requests.quantile(0.5), 'p99': requests.quantile(0.99),
+                 'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+
+
+async def benchmark(server, configs, args):
+    context = multiprocessing.get_context('spawn')
+    print('{:22}{:>8}{:>10}{:>12}{:>10}{:>10}{:>10}{:>10}'.format(
+          'config', 'sec', 'articles', 'requests/s', 'pages/s', 'p50 ms', 'p99 ms', 'RSS MB'))
+    for name in configs:
+        options = dict(CONFIGS[name], end=args.pages + 1, recon=args.recon)   # one page more to see the end
+        results = context.Queue()
+        p = context.Process(target=_crawl, args=(server.url, args.proxies, options, results))
+        p.start()
+        loop = asyncio.get_event_loop()
+        r = await loop.run_in_executor(None, results.get)
+        await loop.run_in_executor(None, p.join)
+        print('{:22}{:>8.2f}{:>10}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+              name, r['elapsed'], r['articles'], r['requests'] / r['elapsed'], r['articles'] / r['elapsed'],
+              r['p50'] * 1000, r['p99'] * 1000, r['rss']))
+        if r['failed']:
+            print('    {} articles failed'.format(r['failed']))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Measure the crawler\'s throughput against a local stub of Pixnet.')
+    parser.add_argument('-c', '--configs', type=str, default=','.join(CONFIGS),
+                        help='The configurations to run, separated by commas, default is all of them: ' + ', '.join(CONFIGS))
+    parser.add_argument('--port', type=int, default=8765, help='The port of the stub server, the fake proxies use the ports after it.')
+    parser.add_argument('--pages', type=int, default=10, help='The number of search result pages, default is 10.')
+    parser.add_argument('--per-page', type=int, default=20, help='The articles on each search page, default is 20.')
+    parser.add_argument('--hares-ratio', type=float, default=0.3, help='The ratio of the Hares articles, default is 0.3.')
+    parser.add_argument('--latency', type=float, default=0.05, help='The seconds of the server\'s latency, default is 0.05.')
+    parser.add_argument('--jitter', type=float, default=0.5, help='The relative variation of the latency, default is 0.5.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='The ratio of the requests answered with 503, default is 0.')
+    parser.add_argument('--size', type=int, default=20000, help='The characters in each article, default is 20000.')
+    parser.add_argument('--proxies', type=int, default=5, help='The number of fake proxies, default is 5.')
+    parser.add_argument('-r', '--recon', type=int, default=3, help='The crawler\'s retries of a failed article, default is 3.')
+    args = parser.parse_args()
+    configs = args.configs.split(',')
+    for name in configs:
+        if name not in CONFIGS:
+            parser.error('Unknown configuration: ' + name)
+    if args.proxies < args.recon + 1:
+        parser.error('--proxies needs to be more than --recon, since the Hares articles are only reachable through the proxies')
+
+    server = StubServer(args.port, args.proxies, args.pages, args.per_page, args.hares_ratio,
+                        args.latency, args.jitter, args.error_rate, args.size)
+    await server.start()
+    print('Stub server: {} articles, {:.0f}% Hares, {} ms latency, {:.0f}% errors, {} proxies'.format(
+          server.articles, args.hares_ratio * 100, args.latency * 1000, args.error_rate * 100, args.proxies))
+    try:
+        await benchmark(server, configs, args)
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import re
+import time
+import random
+import argparse
+from PixnetCrawler import PixnetCrawler
+
+
+def legacy_clean(texts, sw):
+    """
+    The character-by-character stop words removal used before the
+    single-pass normalizer.
+    """
+    result = ''
+    for t in texts:
+        if t not in sw:
+            result += t
+    return result
+
+
+def legacy_normalize(pc, articles):
+    """
+    The former normalization: clean every article, concatenate them,
+    then trim the whitespaces and merge the punctuation marks of the
+    whole corpus.
+    """
+    sw = {w : True for w in pc._sw_no_punc}
+    result = ''
+    for article in articles:
+        result += legacy_clean(article, sw)
+    result = re.sub(r'\s+', '', result)
+    return re.sub('([{}]+)'.format(pc._punc), r'，', result)
+
+
+def new_normalize(pc, articles):
+    pc._result = []
+    pc._tail = ''
+    for article in articles:
+        pc._emit(pc._normalize(article))
+    return ''.join(pc._result)
+
+
+def synthesize(size):
+    """
+    Build a corpus that looks like the HTML fragments of the articles.
+
+    :param size: the approximate size of the corpus in bytes
+    :returns: a list of articles
+    """
+    with open('food_list.txt', 'r', encoding='UTF-8') as f:
+        words = [line.strip() for line in f if line.strip() and '#' not in line]
+    symbols = ['，', '。', '！', ' ', '\n', '～', '...', '<br />', '<p>', '</p>', '😋', 'ㄉ', '2018']
+    random.seed(0)
+    articles = []
+    total = 0
+    while total < size:
+        tokens = ['<div class="article-content-inner">']
+        for i in range(400):
+            tokens.append(random.choice(words))
+            tokens.append(random.choice(symbols))
+        tokens.append('</div>')
+        article = ''.join(tokens)
+        articles.append(article)
+        total += len(article.encode('UTF-8'))
+    return articles
+
+
+def load(filename):
+    with open(filename, 'r', encoding='UTF-8') as f:
+        return f.read().split('\n\n')   # an empty line separates two articles
+
+
+def measure(func, pc, articles, size):
+    start = time.perf_counter()
+    result = func(pc, articles)
+    elapsed = time.perf_counter() - start
+    print('{:20}{:>10.2f} sec{:>10.2f} MB/s'.format(func.__name__, elapsed, size / elapsed / 2**20))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the throughput of the text normalizers.')
+    parser.add_argument('-i', '--input', type=str, help='A corpus file, articles are separated by an empty line.')
+    parser.add_argument('-s', '--size', type=int, default=8, help='The size (MB) of the synthetic corpus if there\'s no input file, default is 8.')
+    args = parser.parse_args()
+
+    articles = load(args.input) if args.input else synthesize(args.size * 2**20)
+    size = sum(len(a.encode('UTF-8')) for a in articles)
+    print('Corpus: {} articles, {:.2f} MB'.format(len(articles), size / 2**20))
+
+    pc = PixnetCrawler()
+    new = measure(new_normalize, pc, articles, size)
+    old = measure(legacy_normalize, pc, articles, size)
+    print('Same output: ' + str(new == old))
+
+
+if __name__ == '__main__':
+    main()
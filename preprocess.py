@@ -1,27 +1,34 @@
-import re
-import jieba
-import jieba.analyse
+import argparse
+import tempfile
+import Segmenter
 import fp_growth_py3 as fp
 
 
-def split_into_word(article, output='list'):
+def split_into_word(article, output='list', segmenter=None):
     """
     Split an article into words.
+    The sentences are segmented in parallel by the segmenter, which loads
+    the dictionary once for all calls.
 
     :param article: an article in string data type
-    :return: a word list, type='list'
+    :param segmenter: a Segmenter, one with jieba's default dictionary is
+                      used for this call if None
+    :return: a word list with '，' between the sentences if type='list',
+             or the words separated by spaces if type='str'
     """
-    jieba.set_dictionary('C:\\Program Files\\Python36\\Lib\\site-packages\\jieba\\dict.txt.big')  # 切換為繁體詞庫
-    seg_list = jieba.cut(article, cut_all=False)  # 精確模式
-    # seg_list = jieba.cut_for_search(article)  # 搜索引擎模式
+    if segmenter is None:
+        with Segmenter.Segmenter() as segmenter:
+            return split_into_word(article, output, segmenter)
+    sentences = segmenter.cut(article)
     if output == 'list':
-        return seg_list
+        words = []
+        for i, sentence in enumerate(sentences):
+            if i:
+                words.append('，')
+            words.extend(sentence)
+        return words
     elif output == 'str':
-        seg = ''
-        for i in seg_list:
-            seg += (i + ' ')
-        seg = re.sub(r'(\s*，\s*)', '，', seg)
-        return seg
+        return '，'.join(' '.join(sentence) for sentence in sentences)
 
 
 def text2trans(text):
@@ -32,15 +39,20 @@ def text2trans(text):
     return trans
 
 
-# remove stop words
-def clean(trans, sw_path):
+def stop_words(sw_path):
     sw_dict = {}
-    clean_trans = []
-    l = []
     with open(sw_path, 'r', encoding='UTF-8') as f:
-        for line in f.readlines():
+        for line in f:
             if '#' not in line:
                 sw_dict[line.strip()] = True
+    return sw_dict
+
+
+# remove stop words
+def clean(trans, sw_path):
+    sw_dict = stop_words(sw_path)
+    clean_trans = []
+    l = []
     for tran in trans:
         for t in tran:
             if t not in sw_dict:
@@ -66,6 +78,98 @@ def rm_dup(trans):
     return l   # l: [{'a', 'b', 'c'}, {'dd, 'ff'}, {'haha', 'eee'}]
 
 
+def read_sentences(filename, chunk_size=1 << 20):
+    """
+    Read the crawler's output a chunk at a time and split it on '，'.
+
+    :param chunk_size: the characters read at a time
+    :return: an iterator over the sentences
+    """
+    tail = ''
+    with open(filename, 'r', encoding='UTF-8') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            sentences = (tail + chunk).split('，')
+            tail = sentences.pop()      # it may continue in the next chunk
+            yield from sentences
+    yield tail
+
+
+def iter_transactions(filename, segmenter, sw_dict):
+    """
+    The streaming version of 'split_into_word', 'text2trans', 'clean' and
+    'rm_dup': only a few chunks of the input are in memory at a time.
+
+    :param sw_dict: the stop words loaded by 'stop_words'
+    :return: an iterator over the transactions, each one a list of the
+             distinct words of a sentence without the stop words
+    """
+    for words in segmenter.segment(read_sentences(filename)):
+        tran = list(dict.fromkeys(word for word in words if word not in sw_dict))
+        if tran:
+            yield tran
+
+
+class Transactions:
+    """
+    The transactions of a file, which can be iterated over more than once,
+    as 'fp_growth_py3.find_frequent_itemsets' does.
+    The first full pass segments the file and spills the transactions to a
+    temporary file, one per line, and the later passes read them from it,
+    so the words are only segmented once and never kept in memory.
+    """
+
+    def __init__(self, filename, segmenter, sw_path):
+        self._filename = filename
+        self._segmenter = segmenter
+        self._sw_dict = stop_words(sw_path)
+        self._spill = None
+        self._count = 0
+
+
+    @property
+    def count(self):
+        return self._count
+
+
+    def __iter__(self):
+        if self._spill is not None:
+            self._spill.seek(0)
+            return (line.split() for line in self._spill)
+        return self._first_pass()
+
+
+    def _first_pass(self):
+        spill = tempfile.TemporaryFile('w+', encoding='UTF-8')
+        count = 0
+        try:
+            for tran in iter_transactions(self._filename, self._segmenter, self._sw_dict):
+                spill.write(' '.join(tran) + '\n')
+                count += 1
+                yield tran
+        except BaseException:
+            spill.close()
+            raise
+        if self._spill is None:     # an abandoned pass never gets here
+            self._spill = spill
+            self._count = count
+        else:
+            spill.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
 def food_dict(filename):
     food = {}
     with open(filename, 'r', encoding='UTF-8') as f:
@@ -113,24 +217,25 @@ def output_result(result, filename):
 
 
 if __name__ == '__main__':
-
-    print('Reading input file...')
-    articles = input('台南 美食(100頁).txt')
-
-    print('Splitting...')
-    s = split_into_word(articles, 'str')
-
-    print('Converting to transactions...')
-    trans = text2trans(s)
+    parser = argparse.ArgumentParser(description='Find the frequent word patterns in the crawled articles.')
+    parser.add_argument('-d', '--dictionary', type=str, help='The path of jieba\'s dictionary, e.g. dict.txt.big for traditional Chinese. Jieba\'s default one if not given.')
+    parser.add_argument('-w', '--workers', type=int, help='The processes segmenting the words, default is the number of CPUs.')
+    parser.add_argument('-c', '--cache', type=str, help='The file caching the words of each sentence, so only the new sentences are segmented.')
+    parser.add_argument('--cache-size', type=int, default=256, help='The maximum megabytes of the cached words, default is 256.')
+    args = parser.parse_args()
 
     sw_path = 'stop_words.txt'
-    print('Cleaning symbols...')
-    trans = clean(trans, sw_path)   # remove stop words
-    trans = rm_dup(trans)
-
-    print('Finding frequent patterns...')
-    fp = fp.find_frequent_itemsets(trans, 2, True)
-    fp = sort(fp)  # sort by support
+    with Segmenter.Segmenter(args.dictionary, args.workers) as segmenter:
+        if args.cache:
+            segmenter.use_cache(args.cache, args.cache_size * 2**20)
+        # the input is read, split, cleaned and de-duplicated while FP-growth counts the words
+        with Transactions('台南 美食(100頁).txt', segmenter, sw_path) as trans:
+            print('Finding frequent patterns...')
+            fp = fp.find_frequent_itemsets(trans, 2, True)
+            fp = sort(fp)  # sort by support
+            print('{} transactions'.format(trans.count))
+        if args.cache:
+            segmenter.cache.report()
 
     food = food_dict('food_list.txt')
     result = find_food(fp, food)   # return's a dictionary
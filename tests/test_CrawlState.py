@@ -0,0 +1,26 @@
+import CrawlState
+
+
+def test_forked_runs_keep_their_own_articles(tmp_path):
+    state = CrawlState.CrawlState(str(tmp_path / 'state.db'))
+    first, second = state.fork(), state.fork()
+    first.start_run('a')
+    second.start_run('b')
+    first.done('https://pixnet.net/1', 200, 'text')
+    second.done('https://pixnet.net/1', 200, 'text')
+    assert first.seen('https://pixnet.net/1')
+    assert second.seen('https://pixnet.net/1')
+    second.failed(['https://pixnet.net/2'])
+    assert not first.seen('https://pixnet.net/2')
+    state.close()
+
+
+def test_incremental_runs_skip_the_articles_of_any_run(tmp_path):
+    state = CrawlState.CrawlState(str(tmp_path / 'state.db'))
+    state.start_run('a')
+    state.done('https://pixnet.net/1', 200, 'text')
+    state.finish_run()
+    state.start_run('a')
+    assert not state.seen('https://pixnet.net/1')
+    assert state.seen('https://pixnet.net/1', incremental=True)
+    state.close()
@@ -0,0 +1,41 @@
+import asyncio
+import HostLimiter
+
+
+async def _request(limiter, url, status):
+    async with limiter.slot(url) as slot:
+        slot.status = status
+
+
+def test_limit_is_cut_on_429():
+    async def run():
+        limiter = HostLimiter.HostLimiter(initial=16)
+        await _request(limiter, 'https://a.pixnet.net/blog/1', 429)
+        return limiter._limiter(('pixnet.net', None))
+    aimd = asyncio.run(run())
+    assert aimd.limit == 8
+    assert aimd.errors == 1
+
+
+def test_limit_grows_on_success():
+    async def run():
+        limiter = HostLimiter.HostLimiter(initial=4)
+        for i in range(8):
+            await _request(limiter, 'https://pixnet.net/{}'.format(i), 200)
+        return limiter._limiter(('pixnet.net', None))
+    assert asyncio.run(run()).limit == 5
+
+
+def test_limit_is_cut_once_per_burst():
+    aimd = HostLimiter.AIMDLimiter(initial=16)
+    for i in range(3):
+        aimd._inflight += 1
+        aimd.release(0.1, True)
+    assert aimd.limit == 8
+
+
+def test_blogs_share_the_limiter_of_the_site():
+    assert HostLimiter.domain('https://a.pixnet.net/blog/post/1') == 'pixnet.net'
+    assert HostLimiter.domain('https://www.pixnet.net/searcharticle?q=x') == 'pixnet.net'
+    assert HostLimiter.domain('http://shop.example.com.tw/') == 'example.com.tw'
+    assert HostLimiter.domain('http://127.0.0.1:8765/pixnet/1') == '127.0.0.1'
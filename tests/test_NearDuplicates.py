@@ -0,0 +1,51 @@
+import random
+import NearDuplicates
+
+
+class _Fixed(NearDuplicates.NearDuplicates):
+    """
+    Take the fingerprints from the texts, so the bits are under control.
+    """
+
+    def fingerprint(self, text):
+        return int(text, 16)
+
+
+def _flip(fingerprint, bits):
+    for bit in bits:
+        fingerprint ^= 1 << bit
+    return '{:x}'.format(fingerprint)
+
+
+def test_near_duplicates_are_caught_in_any_band():
+    base = 0x0123456789abcdef
+    for kept in range(4):       # the band left unchanged, the other three get a bit flipped
+        filter = _Fixed(3)
+        assert not filter.is_duplicate('{:x}'.format(base))
+        bits = [band * 16 + 5 for band in range(4) if band != kept]
+        assert filter.is_duplicate(_flip(base, bits))
+
+
+def test_more_different_bits_than_the_distance_are_kept():
+    base = 0x0123456789abcdef
+    filter = _Fixed(3)
+    assert not filter.is_duplicate('{:x}'.format(base))
+    assert not filter.is_duplicate(_flip(base, [5, 21, 37, 53]))
+    assert filter.kept == 2 and filter.dropped == 0
+
+
+def _article(seed):
+    words = ['台南', '牛肉湯', '湯頭', '清甜', '肉質', '很嫩', '老闆', '親切', '排隊', '人潮',
+             '早餐', '推薦', '價格', '實惠', '環境', '乾淨', '停車', '方便', '下次', '再來']
+    r = random.Random(seed)
+    return '，'.join(''.join(r.choice(words) for _ in range(4)) for _ in range(150))
+
+
+def test_repost_of_an_article_is_dropped():
+    article = _article(1)
+    other = _article(2)
+    filter = NearDuplicates.NearDuplicates(3)
+    assert not filter.is_duplicate(article)
+    assert filter.is_duplicate('轉載：' + article + '，歡迎分享')
+    assert not filter.is_duplicate(other)
+    assert not filter.is_duplicate('')      # no words, never a duplicate
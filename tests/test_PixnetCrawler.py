@@ -0,0 +1,256 @@
+import json
+import asyncio
+import pytest
+import PixnetCrawler
+from aiohttp import web
+from urllib.parse import quote
+
+
+class Site:
+    """
+    A local search site with 'pages' pages of 'links' Pixnet articles each.
+    """
+
+    def __init__(self, pages=3, links=4, declaration=''):
+        self.pages = pages
+        self.links = links
+        self.declaration = declaration
+        self.search_status = 200
+        self.requests = []
+        self._runner = None
+        self.url = None
+
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get('/searcharticle', self.search)
+        app.router.add_get('/pixnet/{n}', self.article)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = 'http://127.0.0.1:{}'.format(self._runner.addresses[0][1])
+        return self
+
+
+    async def __aexit__(self, *args):
+        await self._runner.cleanup()
+
+
+    def article_url(self, n):
+        return '{}/pixnet/{}'.format(self.url, n)
+
+
+    async def search(self, request):
+        page = int(request.query['page'])
+        self.requests.append(('search', page))
+        if self.search_status != 200:
+            return web.Response(status=self.search_status, text='busy')
+        if page > self.pages:
+            return web.Response(text='<html></html>', content_type='text/html')
+        links = ''.join('<li class="search-title"><a href="/r?url={}">x</a></li>'.format(
+                        quote(self.article_url(page * 100 + i), safe='')) for i in range(self.links))
+        return web.Response(text=self.declaration + '<html><body><ul>{}</ul></body></html>'.format(links),
+                            content_type='text/html')
+
+
+    async def article(self, request):
+        n = request.match_info['n']
+        self.requests.append(('article', int(n)))
+        return web.Response(text=self.declaration + '<html><div class="title">標題{0}</div>'
+                                 '<div class="article-content-inner">內容{0}，好吃。</div></html>'.format(n),
+                            content_type='text/html')
+
+
+async def _no_proxies(number):
+    return []
+
+
+def _crawler(site, tmp_path, **options):
+    crawler = PixnetCrawler.PixnetCrawler()
+    crawler.keyword = 'x'
+    crawler.start = 1
+    crawler.end = site.pages
+    crawler.timeout = 5
+    crawler.recon = 0
+    crawler.filename = str(tmp_path / 'out.txt')
+    crawler._search_site = site.url
+    crawler._pool.get_proxies = _no_proxies
+    for name, value in options.items():
+        setattr(crawler, name, value)
+    return crawler
+
+
+def test_pipeline_raises_the_error_of_a_consumer(tmp_path):
+    async def run():
+        async with Site() as site:
+            crawler = _crawler(site, tmp_path, pipeline=True, concurrency=3)
+
+            async def broken(limiter, url, proxies):
+                raise RuntimeError('broken parser')
+            crawler._fetch_article = broken
+            await asyncio.wait_for(crawler.crawl(), 10)
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+
+
+def test_pipeline_crawls_all_articles(tmp_path):
+    async def run():
+        async with Site() as site:
+            crawler = _crawler(site, tmp_path, pipeline=True, concurrency=3)
+            await asyncio.wait_for(crawler.crawl(), 10)
+            return site.requests
+    requests = asyncio.run(run())
+    assert sorted(n for kind, n in requests if kind == 'article') == [page * 100 + i for page in (1, 2, 3) for i in range(4)]
+    assert (tmp_path / 'out.txt').read_text(encoding='UTF-8').count('好吃') == 12
+
+
+@pytest.mark.parametrize('parser', ['inline', 'pool'])
+def test_pages_with_an_xml_declaration_are_parsed(tmp_path, parser):
+    async def run():
+        async with Site(declaration='<?xml version="1.0" encoding="utf-8"?>\n') as site:
+            crawler = _crawler(site, tmp_path, parser=parser, workers=1)
+            await asyncio.wait_for(crawler.crawl(), 30)
+    asyncio.run(run())
+    assert (tmp_path / 'out.txt').read_text(encoding='UTF-8').count('好吃') == 12
+
+
+def _interrupt(monkeypatch, count):
+    """
+    Make the 'count'th article raise an error after the others are fetched.
+    The class is patched, so the crawlers of a batch are interrupted too.
+    """
+    fetch = PixnetCrawler.PixnetCrawler._fetch_attempts
+    urls = []
+
+    async def interrupted(self, limiter, url, proxies):
+        urls.append(url)
+        if len(urls) == count:
+            await asyncio.sleep(0.5)
+            raise RuntimeError('interrupted')
+        await fetch(self, limiter, url, proxies)
+    monkeypatch.setattr(PixnetCrawler.PixnetCrawler, '_fetch_attempts', interrupted)
+
+
+def test_interrupted_crawl_is_resumed(tmp_path, monkeypatch):
+    async def run():
+        async with Site() as site:
+            crawler = _crawler(site, tmp_path)
+            crawler.use_state(str(tmp_path / 'state.db'))
+            _interrupt(monkeypatch, 6)
+            with pytest.raises(RuntimeError):
+                await crawler.crawl()
+            monkeypatch.undo()
+            crawler._state.close()
+            interrupted = (tmp_path / 'out.txt').read_text(encoding='UTF-8').count('好吃')
+            del site.requests[:]
+            crawler = _crawler(site, tmp_path)
+            crawler.use_state(str(tmp_path / 'state.db'))
+            await crawler.crawl()
+            return interrupted, site.requests
+    interrupted, requests = asyncio.run(run())
+    assert interrupted == 11
+    assert [kind for kind, n in requests] == ['article']
+    assert (tmp_path / 'out.txt').read_text(encoding='UTF-8').count('好吃') == 12
+
+
+def _batch(site, tmp_path, **options):
+    crawler = _crawler(site, tmp_path, output_dir=str(tmp_path), **options)
+    crawler._jobs = [{'keyword': 'a'}, {'keyword': 'b'}]
+    crawler.use_state(str(tmp_path / 'state.db'))
+    return crawler
+
+
+def _articles(tmp_path, keyword):
+    return (tmp_path / (keyword + '.txt')).read_text(encoding='UTF-8').count('好吃')
+
+
+def test_interrupted_batch_is_resumed_without_duplicates(tmp_path, monkeypatch):
+    async def run():
+        async with Site() as site:
+            crawler = _batch(site, tmp_path)
+            _interrupt(monkeypatch, 6)
+            with pytest.raises(RuntimeError):
+                await crawler.crawl_batch()
+            monkeypatch.undo()
+            crawler._state.close()
+            interrupted = _articles(tmp_path, 'a'), _articles(tmp_path, 'b')
+            del site.requests[:]
+            crawler = _batch(site, tmp_path)
+            await crawler.crawl_batch()
+            return interrupted, site.requests
+    interrupted, requests = asyncio.run(run())
+    assert interrupted == (11, 11)
+    assert [kind for kind, n in requests] == ['article']     # shared by the keywords
+    assert (_articles(tmp_path, 'a'), _articles(tmp_path, 'b')) == (12, 12)
+
+
+def _records(tmp_path):
+    with open(str(tmp_path / 'records.jsonl'), encoding='UTF-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batch_records_are_overwritten_by_a_new_run(tmp_path):
+    async def run():
+        async with Site() as site:
+            for i in range(2):
+                crawler = _batch(site, tmp_path, records_file=str(tmp_path / 'records.jsonl'))
+                await crawler.crawl_batch()
+                crawler._state.close()
+    asyncio.run(run())
+    records = _records(tmp_path)
+    assert len(records) == 24
+    assert sorted({record['keyword'] for record in records}) == ['a', 'b']
+
+
+class _Response:
+    """
+    A response read in the given chunks.
+    """
+
+    def __init__(self, chunks):
+        self.content = self
+        self.closed = False
+        self._chunks = chunks
+
+
+    async def iter_any(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+    def close(self):
+        self.closed = True
+
+
+def test_hares_link_crossing_the_chunks_is_found():
+    page = ('<p>' + '好' * 20000 + 'x' * 987 + '</p><a href="http://hares.tw/archives/42">繼續閱讀全文</a>' + '<p></p>' * 1000).encode('utf-8')
+    chunks = [page[i:i + 1000] for i in range(0, len(page), 1000)]
+    response = _Response(chunks)
+    link, size = asyncio.run(PixnetCrawler.PixnetCrawler()._scan_hares(response))
+    assert link == 'http://hares.tw/archives/42'
+    assert response.closed
+    assert size == 62000     # the link starts at byte 60994
+    assert asyncio.run(PixnetCrawler.PixnetCrawler()._scan_hares(_Response(chunks[:60]))) == (None, 60000)
+
+
+def test_auto_pagination_stops_at_the_last_page(tmp_path):
+    async def run():
+        async with Site() as site:
+            crawler = _crawler(site, tmp_path, auto_pages=3, end=None)
+            await asyncio.wait_for(crawler.crawl(), 10)
+            return site.requests
+    requests = asyncio.run(run())
+    assert sorted(n for kind, n in requests if kind == 'search') == [1, 2, 3, 4, 5, 6]
+    assert (tmp_path / 'out.txt').read_text(encoding='UTF-8').count('好吃') == 12
+
+
+def test_auto_pagination_stops_when_no_page_is_loaded(tmp_path):
+    async def run():
+        async with Site() as site:
+            site.search_status = 503
+            crawler = _crawler(site, tmp_path, auto_pages=3, end=None)
+            await asyncio.wait_for(crawler.crawl(), 10)
+            return site.requests
+    requests = asyncio.run(run())
+    assert sorted(n for kind, n in requests if kind == 'search') == [1, 2, 3]
@@ -0,0 +1,42 @@
+import sqlite3
+import ResponseCache
+
+
+def _stored(filename):
+    db = sqlite3.connect(filename)
+    try:
+        return db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_writes_are_committed_in_batches(tmp_path):
+    filename = str(tmp_path / 'cache.db')
+    cache = ResponseCache.ResponseCache(filename)
+    for i in range(99):
+        cache.put('https://pixnet.net/{}'.format(i), b'<html></html>', 200, {'ETag': '"e"'})
+    assert _stored(filename) == 0
+    assert cache.get('https://pixnet.net/0')[:3] == (b'<html></html>', 200, True)
+    assert _stored(filename) == 99      # the 100th write commits
+    cache.close()
+
+
+def test_close_commits_the_rest(tmp_path):
+    filename = str(tmp_path / 'cache.db')
+    cache = ResponseCache.ResponseCache(filename)
+    cache.put('https://pixnet.net/1', b'body', 200, {})
+    cache.close()
+    cache = ResponseCache.ResponseCache(filename)
+    assert cache.get('https://pixnet.net/1')[:2] == (b'body', 200)
+    cache.close()
+
+
+def test_least_recently_used_are_evicted_on_commit(tmp_path):
+    cache = ResponseCache.ResponseCache(str(tmp_path / 'cache.db'), max_size=15)    # a body compresses to 12 bytes
+    for i in range(3):
+        cache.put('https://pixnet.net/{}'.format(i), b'a' * 100, 200, {})
+    cache.get('https://pixnet.net/0')
+    cache.commit()
+    assert cache.get('https://pixnet.net/0') is not None
+    assert cache.get('https://pixnet.net/1') is None
+    assert cache.get('https://pixnet.net/2') is None
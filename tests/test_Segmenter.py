@@ -0,0 +1,35 @@
+import Segmenter
+
+
+def _sentences():
+    words = ['台南', '牛肉湯', '好吃', '早午餐', '咖啡', '推薦', '餐廳', '甜點']
+    return ['{}{}{}{}'.format(words[i % 8], words[i * 3 % 8], words[i * 5 % 8], i) for i in range(3000)]
+
+
+def test_cached_segmentation_keeps_the_order(tmp_path):
+    sentences = _sentences()
+    with Segmenter.Segmenter(workers=1, batch_size=500) as segmenter:
+        expected = list(segmenter.segment(sentences))
+    assert len(expected) == len(sentences)
+    cache = str(tmp_path / 'segments.db')
+    for texts in (sentences[:2000], sentences):     # all misses, then hits followed by misses
+        with Segmenter.Segmenter(workers=1, batch_size=500) as segmenter:
+            segmenter.use_cache(cache)
+            assert list(segmenter.segment(texts)) == expected[:len(texts)]
+    assert segmenter.cache.misses == 1000
+    assert segmenter.cache.hits == 2000
+
+
+def test_pool_gives_the_same_words(tmp_path):
+    sentences = _sentences()
+    with Segmenter.Segmenter(workers=1) as segmenter:
+        expected = list(segmenter.segment(sentences))
+    with Segmenter.Segmenter(workers=2, batch_size=500) as segmenter:
+        segmenter.use_cache(str(tmp_path / 'segments.db'))
+        assert list(segmenter.segment(sentences[::2])) == expected[::2]
+        assert list(segmenter.segment(sentences)) == expected
+
+
+def test_sentences_are_split_on_commas():
+    with Segmenter.Segmenter(workers=1) as segmenter:
+        assert segmenter.cut('台南美食，，好吃') == [['台南', '美食'], [], ['好吃']]
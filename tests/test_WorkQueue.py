@@ -0,0 +1,49 @@
+import WorkQueue
+
+
+def _queue(tmp_path, max_attempts=3):
+    queue = WorkQueue.WorkQueue(str(tmp_path / 'test.queue'), max_attempts)
+    queue.setup('keyword', [1])
+    return queue
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    queue = _queue(tmp_path)
+    task = queue.lease('dead', 10, -1)     # expires right away
+    assert queue.lease('alive', 10, 60) == task
+    assert queue.lease('other', 10, 60) == []      # the new lease holds
+    queue.close()
+
+
+def test_task_fails_after_max_attempts(tmp_path):
+    queue = _queue(tmp_path, max_attempts=2)
+    assert len(queue.lease('a', 10, -1)) == 1
+    assert len(queue.lease('b', 10, -1)) == 1
+    assert queue.lease('c', 10, 60) == []
+    assert queue.finished()
+    assert queue.counts() == {('page', 'failed'): 1}
+    queue.close()
+
+
+def test_released_task_is_leased_again_until_max_attempts(tmp_path):
+    queue = _queue(tmp_path, max_attempts=2)
+    (task_id, _, _), = queue.lease('a', 10, 60)
+    queue.release(task_id)
+    assert queue.counts() == {('page', 'pending'): 1}
+    assert len(queue.lease('a', 10, 60)) == 1
+    queue.release(task_id)
+    assert queue.counts() == {('page', 'failed'): 1}
+    queue.close()
+
+
+def test_completed_page_adds_articles(tmp_path):
+    queue = _queue(tmp_path)
+    (task_id, _, _), = queue.lease('a', 10, 60)
+    queue.complete_page(task_id, ['http://a', 'http://b'])
+    articles = queue.lease('a', 10, 60)
+    assert [payload for _, kind, payload in articles] == ['http://a', 'http://b']
+    for task_id, _, payload in reversed(articles):
+        queue.complete_article(task_id, 200, payload + ' text')
+    assert list(queue.texts()) == ['http://a text', 'http://b text']     # in the order they are found
+    assert queue.finished()
+    queue.close()